@@ -6,8 +6,8 @@ import pickle
 from tester import dump_classifier_and_data
 
 sys.path.append("tools/")
-from feature_format import featureFormat, targetFeatureSplit
 import dict_parser
+import feature_cache
 
 
 
@@ -66,17 +66,31 @@ adder_dictionary = {'ratio' :
                     					'expenses',
                     					'other',
                     					'restricted_stock']}}
+# Variables for which log10 and sqrt transformations are added
+log_sqrt = ['wealth', 'exercised_stock_options']
 
 ### Store to my_dataset for easy export below.
+### A ColumnarDataset behaves as the data dictionary but keeps
+### the values in a single float matrix (the dictionary is only
+### built when dumped). Only the new features used in features_list
+### (and those they depend on) are computed.
 my_dataset = dict_parser.parse(data_dict,
 							   outliers,
 							   adder_dictionary,
-							   log_sqrt=['wealth',
-							   'exercised_stock_options'])
+							   log_sqrt=log_sqrt,
+							   output='columnar',
+							   features_list=features_list)
 
 ### Extract features and labels from dataset for local testing
-data = featureFormat(my_dataset, features_list, sort_keys = True)
-labels, features = targetFeatureSplit(data)
+### (cached in data/cache, so that repeated runs do not rebuild them;
+### on a miss, my_dataset is formatted rather than parsed again)
+labels, features = feature_cache.load_features("data/final_project_dataset.pkl",
+											   features_list,
+											   outliers,
+											   adder_dictionary,
+											   log_sqrt,
+											   dataset = my_dataset,
+											   sort_keys = True)
 
 ### Task 4: Try a varity of classifiers
 ### See notebook Classification Full in ../notebooks
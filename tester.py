@@ -12,9 +12,9 @@
 
 import pickle
 import sys
-from sklearn.cross_validation import StratifiedShuffleSplit
 sys.path.append("tools/")
 from feature_format import featureFormat, targetFeatureSplit
+from cv_engine import evaluate_folds, pooled_counts, pooled_scores
 
 PERF_FORMAT_STRING = "\
 \tAccuracy: {:>0.{display_precision}f}\tPrecision: {:>0.{display_precision}f}\t\
@@ -22,49 +22,24 @@ Recall: {:>0.{display_precision}f}\tF1: {:>0.{display_precision}f}\tF2: {:>0.{di
 RESULTS_FORMAT_STRING = "\tTotal predictions: {:4d}\tTrue positives: {:4d}\tFalse positives: {:4d}\
 \tFalse negatives: {:4d}\tTrue negatives: {:4d}"
 
-def test_classifier(clf, dataset, feature_list, folds = 1000):
+def test_classifier(clf, dataset, feature_list, folds = 1000, n_jobs = 1):
     data = featureFormat(dataset, feature_list, sort_keys = True)
-    labels, features = targetFeatureSplit(data)
-    cv = StratifiedShuffleSplit(labels, folds, random_state = 42)
-    true_negatives = 0
-    false_negatives = 0
-    true_positives = 0
-    false_positives = 0
-    for train_idx, test_idx in cv: 
-        features_train = []
-        features_test  = []
-        labels_train   = []
-        labels_test    = []
-        for ii in train_idx:
-            features_train.append( features[ii] )
-            labels_train.append( labels[ii] )
-        for jj in test_idx:
-            features_test.append( features[jj] )
-            labels_test.append( labels[jj] )
-        
-        ### fit the classifier using training set, and test on test set
-        clf.fit(features_train, labels_train)
-        predictions = clf.predict(features_test)
-        for prediction, truth in zip(predictions, labels_test):
-            if prediction == 0 and truth == 0:
-                true_negatives += 1
-            elif prediction == 0 and truth == 1:
-                false_negatives += 1
-            elif prediction == 1 and truth == 0:
-                false_positives += 1
-            elif prediction == 1 and truth == 1:
-                true_positives += 1
-            else:
-                print "Warning: Found a predicted label not == 0 or 1."
-                print "All predictions should take value 0 or 1."
-                print "Evaluating performance for processed predictions:"
-                break
+    labels, features = targetFeatureSplit(data, as_arrays = True)
+
+    ### fit the classifier using training set, and test on test set,
+    ### for every fold (in n_jobs processes)
+    records = evaluate_folds(clf, features, labels, folds,
+                             stop_at_invalid = True, n_jobs = n_jobs)
+
+    for valid in records.valid:
+        if not valid:
+            print "Warning: Found a predicted label not == 0 or 1."
+            print "All predictions should take value 0 or 1."
+            print "Evaluating performance for processed predictions:"
     try:
+        true_negatives, false_positives, false_negatives, true_positives = pooled_counts(records)
         total_predictions = true_negatives + false_negatives + false_positives + true_positives
-        accuracy = 1.0*(true_positives + true_negatives)/total_predictions
-        precision = 1.0*true_positives/(true_positives+false_positives)
-        recall = 1.0*true_positives/(true_positives+false_negatives)
-        f1 = 2.0 * true_positives/(2*true_positives + false_positives+false_negatives)
+        accuracy, precision, recall, f1 = pooled_scores(records)
         f2 = (1+2.0*2.0) * precision*recall/(4*precision + recall)
         print clf
         print PERF_FORMAT_STRING.format(accuracy, precision, recall, f1, f2, display_precision = 5)
@@ -79,6 +54,9 @@ DATASET_PICKLE_FILENAME = "/data/my_dataset.pkl"
 FEATURE_LIST_FILENAME = "/data/my_feature_list.pkl"
 
 def dump_classifier_and_data(clf, dataset, feature_list):
+    ### a ColumnarDataset is dumped as a plain dictionary
+    if hasattr(dataset, "to_dict"):
+        dataset = dataset.to_dict()
     with open(CLF_PICKLE_FILENAME, "w") as clf_outfile:
         pickle.dump(clf, clf_outfile)
     with open(DATASET_PICKLE_FILENAME, "w") as dataset_outfile:
@@ -0,0 +1,472 @@
+"""
+
+    This module contains small benchmarks of the tools, run on
+    synthetic datasets built by resampling the Enron records.
+
+    Run it from the tools folder:
+
+        python benchmark.py
+
+"""
+
+import os
+import sys
+import math
+import time
+import pickle
+import cPickle
+import random
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+import dict_parser
+import variable_adder
+
+DATASET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', 'data', 'final_project_dataset.pkl')
+
+###############################################################
+
+### SYNTHETIC DATASET ###
+
+def synthetic_dataset(n_records,
+                      path = DATASET_PATH,
+                      seed = 42,
+                      outliers = None):
+
+    """
+
+        This function returns a data dictionary with n_records
+        observations, resampled from the Enron dataset without
+        its outliers (records are renamed, so they could not be
+        removed afterwards).
+
+        Args:
+            - n_records: an integer
+            - path: a string, i.e. the path of the Enron pickle
+            - seed: an integer, for the random resampling
+            - outliers: a list, i.e. the names of the records not
+                        to resample. By default OUTLIERS, those of
+                        poi_id.py
+
+        Returns:
+            - data_dict: a Python dictionary formatted as the
+                         Enron one
+
+    """
+
+    with open(path, 'rb') as data_file:
+        enron = pickle.load(data_file)
+
+    if outliers is None:
+        outliers = OUTLIERS
+
+    names = sorted(set(enron.keys()) - set(outliers))
+    rng = random.Random(seed)
+
+    data_dict = {}
+    for i in range(n_records):
+        name = rng.choice(names)
+        data_dict['%s %d' % (name, i)] = dict(enron[name])
+
+    return data_dict
+
+
+def time_function(function, *args, **kwargs):
+
+    """
+
+        This function returns the best wall-clock time (in seconds)
+        of a function call over a number of repeats.
+
+        Args:
+            - function: the function to be timed
+            - args, kwargs: its arguments. The keyword repeat (by
+                            default 3) sets the number of calls
+
+    """
+
+    repeat = kwargs.pop('repeat', 3)
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.time()
+        function(*args, **kwargs)
+        best = min(best, time.time() - start)
+
+    return best
+
+
+def report(title, rows, columns):
+
+    """ Print a benchmark table. """
+
+    sys.stdout.write('\n%s\n' % title)
+    sys.stdout.write('%s\n' % pd.DataFrame(rows, columns = columns)
+                     .to_string(index = False))
+
+###############################################################
+
+### CONVERT INTO DF ###
+
+def convert_into_df_rowwise(data_dict):
+
+    """
+
+        The row by row conversion that dict_parser.convert_into_df
+        replaced, kept as a reference for the benchmark.
+
+    """
+
+    fields = dict_parser.extract_fields_from_dict(data_dict)
+
+    values = []
+    for name, dictionary in data_dict.items():
+
+        obs_list = [name]
+
+        for key, value in dictionary.items():
+
+            if key == 'email_address':
+                obs_list.append(value)
+            else:
+                obs_list.append(float(value))
+
+        values.append(obs_list)
+
+    return pd.DataFrame(values, columns = fields)
+
+
+def bench_convert_into_df(sizes = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)):
+
+    """
+
+        This function compares the row by row and the columnar
+        conversion of a data dictionary into a dataframe.
+
+        Args:
+            - sizes: a list of numbers of records
+
+    """
+
+    rows = []
+    for size in sizes:
+
+        data_dict = synthetic_dataset(size)
+        repeat = 3 if size < 10 ** 6 else 1
+
+        rowwise = time_function(convert_into_df_rowwise, data_dict,
+                                repeat = repeat)
+        columnar = time_function(dict_parser.convert_into_df, data_dict,
+                                 repeat = repeat)
+
+        rows.append([size, rowwise, columnar, rowwise / columnar])
+
+    report('convert_into_df',
+           rows,
+           ['records', 'rowwise_s', 'columnar_s', 'speedup'])
+
+###############################################################
+
+### WRITE DICTIONARY ###
+
+def write_dictionary_rowwise(dataframe):
+
+    """
+
+        The row by row dict_parser.write_dictionary, kept as a
+        reference for the benchmark.
+
+    """
+
+    data_dict = {}
+    variables = dataframe.columns.values.tolist()
+
+    for observation in dataframe.values.tolist():
+
+        obs_dict = {}
+
+        for i in range(1, len(variables)):
+
+            value = observation[i]
+
+            if isinstance(value, float) and math.isnan(value):
+                obs_dict[variables[i]] = 'NaN'
+            else:
+                obs_dict[variables[i]] = value
+
+        data_dict[observation[0]] = obs_dict
+
+    return data_dict
+
+
+def bench_write_dictionary(sizes = (10 ** 3, 10 ** 4, 10 ** 5)):
+
+    """
+
+        This function compares the row by row and the column-wise
+        write_dictionary, and the ColumnarDataset output.
+
+        Args:
+            - sizes: a list of numbers of records
+
+    """
+
+    rows = []
+    for size in sizes:
+
+        dataframe = dict_parser.convert_into_df(synthetic_dataset(size))
+
+        rowwise = time_function(write_dictionary_rowwise, dataframe)
+        columnwise = time_function(dict_parser.write_dictionary,
+                                   dataframe)
+        columnar = time_function(dict_parser.write_dictionary,
+                                 dataframe,
+                                 as_columnar = True)
+
+        rows.append([size, rowwise, columnwise, columnar,
+                     rowwise / columnwise, rowwise / columnar])
+
+    report('write_dictionary',
+           rows,
+           ['records', 'rowwise_s', 'columnwise_s', 'columnar_s',
+            'speedup', 'columnar_speedup'])
+
+###############################################################
+
+### PARALLEL PARSE ###
+
+# Instructions of poi_id.py
+OUTLIERS = ['TOTAL',
+            'SHAPIRO RICHARD S',
+            'KAMINSKI WINCENTY J',
+            'KEAN STEVEN J',
+            'LOCKHART EUGENE E',
+            'THE TRAVEL AGENCY IN THE PARK']
+ADDER_DICTIONARY = {'ratio' : {'exercised_ratio' : ['exercised_stock_options',
+                                                    'total_stock_value'],
+                               'from_poi_ratio' : ['from_poi_to_this_person',
+                                                   'to_messages'],
+                               'to_poi_ratio' : ['from_this_person_to_poi',
+                                                 'from_messages'],
+                               'shared_with_poi_ratio' :
+                                   ['shared_receipt_with_poi',
+                                    'to_messages']},
+                    'additive' : {'wealth' : ['salary',
+                                              'total_payments',
+                                              'bonus',
+                                              'total_stock_value',
+                                              'expenses',
+                                              'other',
+                                              'restricted_stock']}}
+LOG_SQRT = ['wealth', 'exercised_stock_options']
+
+
+def bench_parse_parallel(size = 10 ** 5, n_jobs_list = None):
+
+    """
+
+        This function times dict_parser.parse with an increasing
+        number of processes.
+
+        Args:
+            - size: an integer, i.e. the number of records
+            - n_jobs_list: a list of integers. By default 1, 2, 4...
+                           up to the number of cores
+
+    """
+
+    if n_jobs_list is None:
+        n_jobs_list = [1]
+        while n_jobs_list[-1] * 2 <= multiprocessing.cpu_count():
+            n_jobs_list.append(n_jobs_list[-1] * 2)
+
+    data_dict = synthetic_dataset(size)
+
+    rows = []
+    for n_jobs in n_jobs_list:
+
+        elapsed = time_function(dict_parser.parse,
+                                data_dict,
+                                OUTLIERS,
+                                ADDER_DICTIONARY,
+                                LOG_SQRT,
+                                n_jobs = n_jobs)
+
+        if n_jobs == 1:
+            serial = elapsed
+
+        rows.append([n_jobs, elapsed, serial / elapsed])
+
+    report('parse (%d records)' % size,
+           rows,
+           ['n_jobs', 'seconds', 'speedup'])
+
+
+def start_pool(n_jobs):
+
+    """ Start and stop a pool, with one trivial task per process. """
+
+    pool = multiprocessing.Pool(n_jobs)
+    pool.map(abs, range(n_jobs))
+    pool.close()
+    pool.join()
+
+
+def bench_parse_stages(sizes = (10 ** 4, 10 ** 5, 3 * 10 ** 5),
+                       n_jobs_list = (2, 4, 8, 16)):
+
+    """
+
+        This function times the stages of a sharded
+        dict_parser.parse in a single process, and predicts the
+        time of a parse with n_jobs processes on as many cores:
+
+            pool + work / n_jobs + dumps / n_jobs + loads + concat
+                 (+ write, for a parse into a dictionary)
+
+        where work is the conversion, outlier removal and added
+        variables of all the shards, dumps and loads the pickling
+        of the shard dataframes back to the parent, and write
+        write_dictionary. Unlike bench_parse_parallel it shows the
+        scaling of n_jobs on a machine with fewer cores.
+
+        Args:
+            - sizes: a list of integers, i.e. numbers of records
+            - n_jobs_list: a list of integers
+
+    """
+
+    plan = variable_adder.compile_plan(ADDER_DICTIONARY, LOG_SQRT)
+
+    stages = []
+    rows = []
+    for size in sizes:
+
+        data_dict = synthetic_dataset(size)
+
+        pool = time_function(start_pool, max(n_jobs_list), repeat = 1)
+
+        work = time_function(dict_parser._parse_shard,
+                             (data_dict, None, 0, OUTLIERS, plan),
+                             repeat = 1)
+        dataframe = dict_parser._parse_shard((data_dict, None, 0,
+                                              OUTLIERS, plan))
+
+        # As the results of pool.map are sent back
+        protocol = cPickle.HIGHEST_PROTOCOL
+        dumps = time_function(cPickle.dumps, dataframe, protocol,
+                              repeat = 1)
+        loads = time_function(cPickle.loads,
+                              cPickle.dumps(dataframe, protocol),
+                              repeat = 1)
+        write = time_function(dict_parser.write_dictionary, dataframe,
+                              repeat = 1)
+
+        stages.append([size, pool, work, dumps, loads, write])
+
+        for n_jobs in n_jobs_list:
+
+            shards = np.array_split(np.arange(len(dataframe)), n_jobs)
+            pieces = [dataframe.iloc[shard] for shard in shards]
+            concat = time_function(pd.concat, pieces, repeat = 1)
+
+            sharded = pool + (work + dumps) / n_jobs + loads + concat
+
+            rows.append([size, n_jobs,
+                         work / sharded,
+                         (work + write) / (sharded + write)])
+
+    report('parse stages (seconds, one process)',
+           stages,
+           ['records', 'pool', 'work', 'dumps', 'loads', 'write'])
+
+    report('parse: predicted speedup on n_jobs cores',
+           rows,
+           ['records', 'n_jobs', 'dataframe', 'dict'])
+
+###############################################################
+
+### TRANSFORMS ###
+
+# pandas versions of the registered transforms, kept as a
+# reference for the benchmark
+PANDAS_TRANSFORMS = {
+    'ratio': lambda df: df['bonus'] / df['salary'],
+    'additive': lambda df: (df['salary'].fillna(0)
+                            + df['bonus'].fillna(0)
+                            + df['expenses'].fillna(0)),
+    'difference': lambda df: df['bonus'] - df['salary'],
+    'product': lambda df: df['bonus'] * df['salary'],
+    'clipped_ratio': lambda df: (df['from_poi_to_this_person']
+                                 / df['to_messages']).clip(0, 1),
+    'log': lambda df: np.log10(df['salary']),
+    'sqrt': lambda df: np.sqrt(df['salary']),
+    'rank': lambda df: df['salary'].rank(),
+    'quantile': lambda df: df['salary'].rank(pct = True)}
+
+TRANSFORM_INPUTS = {'ratio': ['bonus', 'salary'],
+                    'additive': ['salary', 'bonus', 'expenses'],
+                    'difference': ['bonus', 'salary'],
+                    'product': ['bonus', 'salary'],
+                    'clipped_ratio': ['from_poi_to_this_person',
+                                      'to_messages'],
+                    'log': ['salary'],
+                    'sqrt': ['salary'],
+                    'rank': ['salary'],
+                    'quantile': ['salary']}
+
+
+def bench_transforms(size = 10 ** 6):
+
+    """
+
+        This function times every registered transform, writing
+        into a float64 and a float32 column, against its pandas
+        version.
+
+        Args:
+            - size: an integer, i.e. the number of records
+
+    """
+
+    dataframe = dict_parser.convert_into_df(synthetic_dataset(size))
+
+    rows = []
+    for name in sorted(TRANSFORM_INPUTS):
+
+        function = variable_adder.TRANSFORMS[name].function
+        initial = variable_adder.TRANSFORMS[name].initial
+        inputs = [dataframe[variable].values.astype(float)
+                  for variable in TRANSFORM_INPUTS[name]]
+
+        def run(dtype):
+            out = np.empty(size, dtype = dtype)
+            if initial is not None:
+                out[:] = initial
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                function(inputs, out)
+
+        reference = time_function(PANDAS_TRANSFORMS[name], dataframe)
+        float64 = time_function(run, float)
+        float32 = time_function(run, np.float32)
+
+        rows.append([name, reference, float64, float32,
+                     reference / float64])
+
+    report('transforms (%d records)' % size,
+           rows,
+           ['transform', 'pandas_s', 'float64_s', 'float32_s',
+            'speedup'])
+
+###############################################################
+
+if __name__ == '__main__':
+
+    bench_convert_into_df()
+    bench_write_dictionary()
+    bench_parse_parallel()
+    bench_parse_stages()
+    bench_transforms()
@@ -0,0 +1,802 @@
+"""
+
+    The cv_engine Python module runs the folds of a cross
+    validation, e.g. the 1,000 StratifiedShuffleSplit folds of
+    tester.py, either one after another or in a process pool.
+
+    A fold function receives a fitted-to-be classifier and the
+    train and test arrays of one fold, and returns a small result
+    (e.g. confusion counts or a list of scores):
+
+        results = run_folds(clf,
+                            features,
+                            labels,
+                            folds,
+                            fold_function,
+                            n_jobs = 4)
+
+    Results are returned in the order of the folds, so reducing
+    them gives the same numbers whatever the number of processes.
+
+    evaluate_folds fits every fold once and returns a record array
+    with one row per fold (confusion counts and per-fold scores).
+    All the flavours of evaluation are derived from it:
+
+        records = evaluate_folds(clf, features, labels)
+        pooled_scores(records)  # as tester.py
+        mean_scores(records)    # as evaluate.eval_clf
+
+    evaluate_folds_sequential runs the folds in batches and stops
+    once the pooled scores are known well enough.
+
+    A GaussianNB (alone or after a MinMaxScaler) is not fitted on
+    every fold: its folds are computed at once from sufficient
+    statistics by naive_bayes_cv, with the same predictions.
+
+"""
+
+import multiprocessing
+
+import numpy as np
+from scipy.stats import norm
+from sklearn.base import clone
+from sklearn.preprocessing import MinMaxScaler
+
+import splits
+import naive_bayes_cv
+from transform_cache import TransformCache, split_pipeline
+
+###############################################################
+
+### CONFUSION COUNTS ###
+
+def confusion_counts(truth, predictions, stop_at_invalid = False):
+
+    """
+
+        This function counts true negatives, false positives,
+        false negatives and true positives of a single fold (see
+        batched_confusion_counts).
+
+        Args:
+            - truth, predictions: numpy arrays of labels
+            - stop_at_invalid: a boolean. Labels or predictions not
+                               equal to 0 or 1 are always skipped;
+                               if True, everything after the first
+                               of them is skipped too (as in
+                               tester.py)
+
+        Returns:
+            - counts: a numpy array of integers, i.e. tn, fp, fn
+                      and tp
+            - valid: a boolean, False if a label or a prediction
+                     was not 0 or 1
+
+    """
+
+    counts, valid = batched_confusion_counts(
+        np.asarray(truth)[np.newaxis, :],
+        np.asarray(predictions)[np.newaxis, :],
+        stop_at_invalid)
+
+    return counts[0], bool(valid[0])
+
+
+def batched_confusion_counts(truth, predictions, stop_at_invalid = False):
+
+    """
+
+        This function counts true negatives, false positives,
+        false negatives and true positives of every fold with one
+        np.bincount of 2 * truth + prediction, fold i taking the
+        bins 4 * i to 4 * i + 3.
+
+        Args:
+            - truth, predictions: numpy arrays of labels, one row
+                                  per fold
+            - stop_at_invalid: a boolean, as in confusion_counts
+                               (within every fold)
+
+        Returns:
+            - counts: a numpy array of integers, one row of tn, fp,
+                      fn and tp per fold
+            - valid: a boolean numpy array, False for the folds
+                     where a label or a prediction was not 0 or 1
+
+    """
+
+    truth = np.asarray(truth)
+    predictions = np.asarray(predictions)
+
+    valid = ((predictions == 0) | (predictions == 1)) & \
+            ((truth == 0) | (truth == 1))
+    all_valid = valid.all(axis = 1)
+
+    if stop_at_invalid:
+        valid = np.logical_and.accumulate(valid, axis = 1)
+
+    codes = 2 * truth[valid].astype(np.int64) \
+            + predictions[valid].astype(np.int64)
+    codes += 4 * np.nonzero(valid)[0]
+
+    counts = np.bincount(codes, minlength = 4 * len(truth))
+
+    return counts.reshape(len(truth), 4), all_valid
+
+###############################################################
+
+### FOLD EXECUTION ###
+
+# Classifier, arrays, folds and fold function shared with the
+# pool workers
+_FOLD_SOURCE = None
+
+def _set_fold_source(source):
+
+    global _FOLD_SOURCE
+    _FOLD_SOURCE = source
+
+
+def _run_batch(bounds):
+
+    """
+
+        This function runs the fold function on a contiguous batch
+        of the shared folds, with a clone of the shared classifier.
+
+    """
+
+    clf, features, labels, folds, fold_function = _FOLD_SOURCE
+    start, end = bounds
+
+    # A classifier fitted again on every fold of the batch, as the
+    # one of a serial run
+    clf = clone(clf, safe = False)
+
+    return [fold_function(clf,
+                          features[train_idx],
+                          labels[train_idx],
+                          features[test_idx],
+                          labels[test_idx])
+            for train_idx, test_idx in folds[start:end]]
+
+
+def run_folds(clf,
+              features,
+              labels,
+              folds,
+              fold_function,
+              n_jobs = 1,
+              batches_per_job = 4):
+
+    """
+
+        This function runs a fold function on every fold of a cross
+        validation.
+
+        Args:
+            - clf: a classifier
+            - features, labels: array of features, labels extracted
+                                from the dataset
+            - folds: a list of (train_idx, test_idx) pairs, e.g.
+                     list(StratifiedShuffleSplit(...))
+            - fold_function: a function taking clf, features_train,
+                             labels_train, features_test and
+                             labels_test
+            - n_jobs: an integer, i.e. the number of processes. If
+                      greater than 1 (or -1 for all the cores) the
+                      folds are split into contiguous batches, each
+                      one run with a clone of clf in a process pool.
+                      clf itself is then left unfitted
+            - batches_per_job: an integer, i.e. the number of
+                               batches per process (more batches
+                               balance the load better)
+
+        Returns:
+            - results: a Python list, i.e. the result of every fold
+                       in the order of folds
+
+        The arrays reach the workers through the pool initializer,
+        i.e. they are inherited (not pickled) where processes are
+        forked, and only the fold results are sent back.
+
+    """
+
+    features = np.asarray(features)
+    labels = np.asarray(labels)
+    folds = list(folds)
+
+    if n_jobs == -1:
+        n_jobs = multiprocessing.cpu_count()
+
+    if n_jobs <= 1 or len(folds) < 2:
+
+        return [fold_function(clf,
+                              features[train_idx],
+                              labels[train_idx],
+                              features[test_idx],
+                              labels[test_idx])
+                for train_idx, test_idx in folds]
+
+    n_batches = max(1, min(n_jobs * batches_per_job, len(folds)))
+    bounds = np.linspace(0, len(folds), n_batches + 1).astype(int)
+    batches = [(int(start), int(end))
+               for start, end in zip(bounds[:-1], bounds[1:])]
+
+    source = (clf, features, labels, folds, fold_function)
+
+    pool = multiprocessing.Pool(n_jobs,
+                                initializer = _set_fold_source,
+                                initargs = (source,))
+    try:
+        results = pool.map(_run_batch, batches, chunksize = 1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return [result for batch in results for result in batch]
+
+###############################################################
+
+### FOLD RECORDS ###
+
+# Fields of a fold record, followed by one float field for every
+# extra scorer
+RECORD_FIELDS = [('tn', np.int64),
+                 ('fp', np.int64),
+                 ('fn', np.int64),
+                 ('tp', np.int64),
+                 ('valid', np.bool_),
+                 ('accuracy', np.float64),
+                 ('precision', np.float64),
+                 ('recall', np.float64),
+                 ('f1', np.float64),
+                 ('f2', np.float64)]
+
+
+def make_folds(labels, n_folds = 1000, random_state = 42):
+
+    """
+
+        This function returns the folds of tester.py, i.e. a list
+        of (train_idx, test_idx) pairs from StratifiedShuffleSplit,
+        drawn once per dataset (see splits).
+
+    """
+
+    return splits.load_folds(labels,
+                             n_folds,
+                             random_state = random_state)
+
+
+class _RecordFold(object):
+
+    """
+
+        The fold function of evaluate_folds: it fits a classifier
+        and returns the confusion counts, whether the fold was
+        valid and the extra scores.
+
+    """
+
+    def __init__(self, stop_at_invalid, scorers):
+
+        self.stop_at_invalid = stop_at_invalid
+        self.scorers = scorers
+
+    def __call__(self, clf, features_train, labels_train,
+                 features_test, labels_test):
+
+        clf.fit(features_train, labels_train)
+        predictions = clf.predict(features_test)
+
+        counts, valid = confusion_counts(labels_test,
+                                         predictions,
+                                         self.stop_at_invalid)
+        extra = [scorer(labels_test, predictions)
+                 for _, scorer in self.scorers]
+
+        return counts, valid, extra
+
+
+def divide_or_zero(numerator, denominator):
+
+    """ numerator / denominator, and 0 where denominator is 0. """
+
+    numerator = np.asarray(numerator, dtype = float)
+    denominator = np.asarray(denominator, dtype = float)
+
+    ratio = np.zeros(len(numerator))
+    np.divide(numerator, denominator, out = ratio,
+              where = denominator != 0)
+
+    return ratio
+
+
+def _fast_counts(clf, features, labels, folds, stop_at_invalid = False):
+
+    """
+
+        This function returns the confusion counts and validity of
+        every fold computed by naive_bayes_cv, or None if the
+        classifier or the folds are not supported (folds of
+        different sizes, training rows that are not all the rows
+        but the test ones, or a class missing from a training
+        fold).
+
+        clf is then fitted on the last training fold, i.e. left as
+        the loop over the folds leaves it.
+
+    """
+
+    if not naive_bayes_cv.supports(clf) or not len(folds):
+        return None
+
+    if len(set(len(train_idx) for train_idx, _ in folds)) > 1 or \
+       len(set(len(test_idx) for _, test_idx in folds)) > 1:
+        return None
+
+    train = np.array([train_idx for train_idx, _ in folds])
+    test = np.array([test_idx for _, test_idx in folds])
+
+    # Training rows must be all the rows but the test ones
+    rows = np.arange(len(folds))[:, np.newaxis]
+    covered = np.zeros((len(folds), len(labels)), dtype = np.int8)
+    covered[rows, train] += 1
+    covered[rows, test] += 1
+    if (covered != 1).any():
+        return None
+
+    classes = np.unique(labels)
+    present = (labels[train][:, :, np.newaxis] == classes).any(axis = 1)
+    if not present.all():
+        return None
+
+    predictions = naive_bayes_cv.predict_folds(clf, features, labels,
+                                               train, test)
+    counts = batched_confusion_counts(labels[test], predictions,
+                                      stop_at_invalid)
+
+    clf.fit(features[train[-1]], labels[train[-1]])
+
+    return counts
+
+
+def evaluate_folds(clf,
+                   features,
+                   labels,
+                   folds = 1000,
+                   random_state = 42,
+                   prescale = False,
+                   stop_at_invalid = False,
+                   scorers = None,
+                   n_jobs = 1):
+
+    """
+
+        This function fits a classifier once on every fold and
+        returns one record per fold.
+
+        Args:
+            - clf: a classifier
+            - features, labels: array of features, labels extracted
+                                from the dataset
+            - folds: an integer, i.e. the number of folds of
+                     make_folds, or a list of (train_idx, test_idx)
+                     pairs
+            - random_state: an integer, used by make_folds
+            - prescale: a boolean. If True, features are scaled with
+                        MinMaxScaler before the folds are drawn (as
+                        in modified_tester.py)
+            - stop_at_invalid: a boolean (see confusion_counts)
+            - scorers: a list of (name, function) pairs. Every
+                       function takes the labels and predictions of
+                       a fold and returns a float
+            - n_jobs: an integer (see run_folds)
+
+        Returns:
+            - records: a numpy record array with the RECORD_FIELDS
+                       and the scorer names as fields. Per-fold
+                       scores are those of sklearn.metrics, i.e. 0
+                       when they are undefined
+
+    """
+
+    scorers = list(scorers or [])
+
+    features = np.asarray(features)
+    labels = np.asarray(labels)
+
+    if prescale:
+        features = MinMaxScaler().fit_transform(features)
+
+    if isinstance(folds, int):
+        folds = make_folds(labels, folds, random_state)
+
+    if not scorers:
+        fast = _fast_counts(clf, features, labels, folds, stop_at_invalid)
+        if fast is not None:
+            return fold_records(*fast)
+
+    results = run_folds(clf,
+                        features,
+                        labels,
+                        folds,
+                        _RecordFold(stop_at_invalid, scorers),
+                        n_jobs = n_jobs)
+
+    return fold_records(np.array([result[0] for result in results]),
+                        [result[1] for result in results],
+                        [(name, [result[2][i] for result in results])
+                         for i, (name, _) in enumerate(scorers)])
+
+
+def fold_records(counts, valid, extra = None):
+
+    """
+
+        This function builds the record array of evaluate_folds
+        from the confusion counts of every fold.
+
+        Args:
+            - counts: an integer numpy array, one row of tn, fp, fn
+                      and tp per fold
+            - valid: a boolean array, one value per fold
+            - extra: a list of (name, values) pairs of extra scores
+
+        Returns:
+            - records: a numpy record array with the RECORD_FIELDS
+                       and the extra names as fields. Per-fold
+                       scores are those of sklearn.metrics, i.e. 0
+                       when they are undefined
+
+    """
+
+    extra = list(extra or [])
+
+    records = np.zeros(len(counts),
+                       dtype = RECORD_FIELDS + [(name, np.float64)
+                                                for name, _ in extra])
+    if not len(counts):
+        return records.view(np.recarray)
+
+    tn, fp, fn, tp = np.asarray(counts).T
+
+    records['tn'], records['fp'], records['fn'], records['tp'] = \
+        tn, fp, fn, tp
+    records['valid'] = valid
+
+    # Per-fold scores, as accuracy_score, precision_score,
+    # recall_score, f1_score and fbeta_score(beta = 2)
+    precision = divide_or_zero(tp, tp + fp)
+    recall = divide_or_zero(tp, tp + fn)
+
+    records['accuracy'] = divide_or_zero(tp + tn, tn + fp + fn + tp)
+    records['precision'] = precision
+    records['recall'] = recall
+    records['f1'] = np.where(tp == 0, 0.,
+                             divide_or_zero(2 * precision * recall,
+                                            precision + recall))
+    records['f2'] = np.where(tp == 0, 0.,
+                             divide_or_zero(5 * precision * recall,
+                                            4 * precision + recall))
+
+    for name, values in extra:
+        records[name] = values
+
+    return records.view(np.recarray)
+
+
+def evaluate_folds_shared(clfs,
+                          features,
+                          labels,
+                          folds = 1000,
+                          random_state = 42,
+                          cache = None):
+
+    """
+
+        This function evaluates a list of classifiers on the same
+        folds, fold by fold, sharing the transformers of their
+        pipelines (e.g. the MinMaxScaler of clf_builder) through a
+        TransformCache.
+
+        Args:
+            - clfs: a list of classifiers
+            - features, labels, folds, random_state: as in
+              evaluate_folds
+            - cache: a TransformCache. By default a new one
+
+        Returns:
+            - records: a list with the record array of every
+                       classifier, the same as evaluate_folds
+
+        Every classifier is left fitted on the last training fold,
+        as evaluate_folds leaves it.
+
+    """
+
+    features = np.asarray(features)
+    labels = np.asarray(labels)
+
+    if isinstance(folds, int):
+        folds = make_folds(labels, folds, random_state)
+
+    if cache is None:
+        cache = TransformCache()
+
+    counts = np.zeros((len(clfs), len(folds), 4), dtype = np.int64)
+    valid = np.zeros((len(clfs), len(folds)), dtype = bool)
+
+    # Classifiers computed at once by naive_bayes_cv are skipped
+    # in the loop over the folds
+    steps = []
+    for i, clf in enumerate(clfs):
+
+        fast = _fast_counts(clf, features, labels, folds)
+        if fast is not None:
+            counts[i], valid[i] = fast
+            continue
+
+        transformers, estimator = split_pipeline(clf)
+        steps.append((i, cache.chain(transformers), estimator))
+
+    # Fold-major, so that the blocks of a fold are used by every
+    # classifier before they are evicted
+    for fold_id, (train_idx, test_idx) in enumerate(folds):
+
+        features_train = features[train_idx]
+        labels_train = labels[train_idx]
+        features_test = features[test_idx]
+        labels_test = labels[test_idx]
+
+        for i, chain, estimator in steps:
+
+            train, test = cache.transform(fold_id,
+                                          chain,
+                                          features_train,
+                                          labels_train,
+                                          features_test)
+
+            estimator.fit(train, labels_train)
+            counts[i, fold_id], valid[i, fold_id] = \
+                confusion_counts(labels_test, estimator.predict(test))
+
+    # The transformers of the cache are clones: those of every
+    # pipeline are fitted on the last training fold, so that the
+    # pipelines are left as the loop over the folds leaves them
+    if len(folds):
+        train_idx = folds[-1][0]
+        for i, chain, estimator in steps:
+            train = features[train_idx]
+            for step in split_pipeline(clfs[i])[0]:
+                train = step.fit_transform(train, labels[train_idx])
+
+    return [fold_records(counts[i], valid[i]) for i in range(len(clfs))]
+
+
+def pooled_counts(records):
+
+    """
+
+        This function returns the confusion counts summed over the
+        folds, as Python integers, i.e. tn, fp, fn and tp.
+
+    """
+
+    return [int(records[field].sum()) for field in ('tn', 'fp', 'fn', 'tp')]
+
+
+def pooled_scores(records):
+
+    """
+
+        This function returns the scores of tester.py, i.e. computed
+        on the confusion counts summed over the folds.
+
+        Args:
+            - records: a record array, as returned by evaluate_folds
+
+        Returns:
+            - a list of scores, i.e. accuracy, precision, recall
+              and f1. A ZeroDivisionError is raised if one of them
+              is undefined (f2 is left to the callers, as it is also
+              undefined when precision and recall are both 0)
+
+    """
+
+    true_negatives, false_positives, false_negatives, true_positives = \
+        pooled_counts(records)
+
+    total_predictions = true_negatives + false_negatives \
+                        + false_positives + true_positives
+    accuracy = 1.0*(true_positives + true_negatives)/total_predictions
+    precision = 1.0*true_positives/(true_positives+false_positives)
+    recall = 1.0*true_positives/(true_positives+false_negatives)
+    f1 = 2.0 * true_positives/(2*true_positives + false_positives+false_negatives)
+
+    return [accuracy, precision, recall, f1]
+
+
+def mean_scores(records, fields = ('accuracy', 'precision', 'recall', 'f1')):
+
+    """
+
+        This function returns per-fold scores averaged over the
+        folds (as evaluate.eval_clf).
+
+        Args:
+            - records: a record array, as returned by evaluate_folds
+            - fields: the names of the scores to average
+
+        Returns:
+            - a list of scores
+
+    """
+
+    # Contiguous copies, so that the means are summed as they were
+    # from plain lists
+    return [np.array(records[field]).mean() for field in fields]
+
+###############################################################
+
+### EARLY STOPPING ###
+
+# Pooled scores as ratios of sums of per-fold counts, i.e.
+# numerator and denominator fields
+POOLED_RATIOS = {'precision': (('tp',), ('tp', 'fp')),
+                 'recall': (('tp',), ('tp', 'fn')),
+                 'f1': (('tp', 'tp'), ('tp', 'tp', 'fp', 'fn'))}
+
+
+def pooled_interval(records, metric, confidence = 0.95):
+
+    """
+
+        This function returns a pooled score and the half-width of
+        its confidence interval, treating folds as independent
+        draws (ratio estimator with a normal approximation).
+
+        Args:
+            - records: a record array, as returned by evaluate_folds
+            - metric: 'precision', 'recall' or 'f1'
+            - confidence: a float, i.e. the confidence level
+
+        Returns:
+            - estimate: a float (NaN if undefined)
+            - half_width: a float (inf if undefined)
+
+    """
+
+    numerator_fields, denominator_fields = POOLED_RATIOS[metric]
+
+    numerator = np.sum([records[field] for field in numerator_fields],
+                       axis = 0).astype(float)
+    denominator = np.sum([records[field] for field in denominator_fields],
+                         axis = 0).astype(float)
+
+    n = len(records)
+    if n < 2 or not denominator.sum():
+        return np.nan, np.inf
+
+    estimate = numerator.sum() / denominator.sum()
+
+    # Variance of a ratio of means, by the delta method
+    residuals = numerator - estimate * denominator
+    variance = np.sum(residuals ** 2) / (n * (n - 1)) \
+               / denominator.mean() ** 2
+
+    z = norm.ppf(0.5 + confidence / 2.)
+
+    return estimate, z * np.sqrt(variance)
+
+
+def stop_reason(records,
+                threshold = 0.3,
+                tolerance = 0.01,
+                confidence = 0.95):
+
+    """
+
+        This function tells whether the folds evaluated so far are
+        enough, i.e. if either:
+
+            - 'below': precision or recall is below threshold;
+            - 'above': precision and recall are above threshold;
+            - 'tolerance': precision, recall and f1 are known
+                           within tolerance;
+
+        with the given confidence. It returns None otherwise.
+
+    """
+
+    intervals = dict((metric, pooled_interval(records, metric, confidence))
+                     for metric in ('precision', 'recall', 'f1'))
+
+    # Intervals with a NaN estimate compare as False
+    if any(estimate + half_width < threshold
+           for estimate, half_width in (intervals['precision'],
+                                        intervals['recall'])):
+        return 'below'
+
+    if all(estimate - half_width > threshold
+           for estimate, half_width in (intervals['precision'],
+                                        intervals['recall'])):
+        return 'above'
+
+    if all(half_width <= tolerance
+           for _, half_width in intervals.values()):
+        return 'tolerance'
+
+    return None
+
+
+def evaluate_folds_sequential(clf,
+                              features,
+                              labels,
+                              folds = 1000,
+                              random_state = 42,
+                              prescale = False,
+                              threshold = 0.3,
+                              tolerance = 0.01,
+                              confidence = 0.95,
+                              min_folds = 100,
+                              batch_size = 50,
+                              n_jobs = 1,
+                              **kwargs):
+
+    """
+
+        This function runs evaluate_folds on batches of folds, in
+        order, and stops as soon as stop_reason says the folds
+        evaluated so far are enough.
+
+        Args:
+            - clf, features, labels, folds, random_state, prescale,
+              n_jobs: as in evaluate_folds (other keyword arguments
+              are passed to it)
+            - threshold, tolerance, confidence: see stop_reason
+            - min_folds: an integer, i.e. the number of folds run
+                         before stopping is considered
+            - batch_size: an integer, i.e. the number of folds run
+                          between two checks
+
+        Returns:
+            - records: a record array, i.e. the records of the
+                       folds used (the first len(records) folds)
+            - reason: a string, i.e. the output of stop_reason, or
+                      'exhausted' if every fold was used
+
+    """
+
+    features = np.asarray(features)
+    labels = np.asarray(labels)
+
+    if prescale:
+        features = MinMaxScaler().fit_transform(features)
+
+    if isinstance(folds, int):
+        folds = make_folds(labels, folds, random_state)
+
+    batches = []
+    start = 0
+
+    while start < len(folds):
+
+        end = max(start + batch_size, min_folds)
+        batches.append(evaluate_folds(clf,
+                                      features,
+                                      labels,
+                                      folds[start:end],
+                                      n_jobs = n_jobs,
+                                      **kwargs))
+        start = end
+
+        records = np.concatenate(batches).view(np.recarray)
+
+        if start < len(folds):
+            reason = stop_reason(records, threshold, tolerance, confidence)
+            if reason is not None:
+                return records, reason
+
+    return np.concatenate(batches).view(np.recarray), 'exhausted'
@@ -0,0 +1,773 @@
+"""
+
+    The dataset_store Python module contains a compact, columnar
+    version of the Enron data dictionary.
+
+    The Enron dataset is a Python dictionary formatted as
+    {name: {feature: value}}, where missing values are the 'NaN'
+    string. That costs a Python dict per person plus a boxed
+    value per cell. A ColumnarDataset stores instead:
+
+        - a float64 matrix (one row per person, one column
+          per feature);
+        - a bitmask of the cells that were 'NaN' in the
+          original dictionary;
+        - a name -> row index and a feature -> column index.
+
+    Non-numeric features (i.e. email_address) are kept as
+    object columns.
+
+    A ColumnarDataset is a mapping (read-only, but for upsert), i.e.
+    dataset[name][feature] returns the same value as the data
+    dictionary (numbers as floats, missing values as 'NaN'), so it
+    can be passed to featureFormat or dumped with
+    dump_classifier_and_data in place of the dictionary.
+
+"""
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+import os
+import json
+import shutil
+import numpy as np
+
+###############################################################
+
+### HELPERS ###
+
+def _to_float_column(values):
+
+    """
+
+        This function converts a list of values into a float64
+        array and a boolean array marking the 'NaN' strings.
+
+        Args:
+            - values: a Python list
+
+        Returns:
+            - column: a numpy array, or None if the values are
+                      not numeric
+            - missing: a boolean numpy array
+
+    """
+
+    missing = np.array([isinstance(value, str) and value == 'NaN'
+                        for value in values], dtype=bool)
+
+    try:
+        column = np.array(values, dtype=float)
+    except (ValueError, TypeError):
+        return None, missing
+
+    return column, missing
+
+###############################################################
+
+### COLUMNAR DATASET ###
+
+class ColumnarDataset(Mapping):
+
+    """
+
+        A columnar replacement for the Enron data dictionary. The
+        mapping is read-only; upsert updates it in place.
+
+        Args:
+            - names: a list of names, i.e. the row order
+            - features: a list of feature names, i.e. the column
+                        order
+            - matrix: a (names x features) float64 numpy array,
+                      with NaN in missing or non-numeric cells
+            - missing: a (names x features) boolean numpy array,
+                       True where the original value was 'NaN'
+            - objects: a dictionary {feature: object array} for
+                       non-numeric features
+            - bools: a list of features whose values are booleans
+
+    """
+
+    def __init__(self, names, features, matrix, missing,
+                 objects = None, bools = None):
+
+        self._names = list(names)
+        self._features = list(features)
+        self._matrix = np.ascontiguousarray(matrix, dtype=float)
+
+        # Missing values are packed 8 per byte, one row of bits
+        # per feature
+        missing = np.asarray(missing, dtype=bool)
+        self._missing_bits = np.packbits(missing.T, axis=1)
+
+        self._objects = dict(objects or {})
+        self._bools = set(bools or [])
+
+        self._rows = dict((name, i) for i, name in enumerate(self._names))
+        self._columns = dict((feature, j)
+                             for j, feature in enumerate(self._features))
+
+    @classmethod
+    def from_dict(cls, data_dict):
+
+        """
+
+            This function builds a ColumnarDataset from a Python
+            dictionary formatted as the Enron dataset.
+
+            Args:
+                - data_dict: a Python dictionary
+
+            Returns:
+                - dataset: a ColumnarDataset
+
+        """
+
+        names = list(data_dict.keys())
+        records = [data_dict[name] for name in names]
+
+        features = list(records[0].keys()) if records else []
+        for name, record in zip(names, records):
+            if len(record) != len(features) \
+                    or any(feature not in record for feature in features):
+                raise ValueError('%s does not have the same features '
+                                 'as the other records' % name)
+
+        matrix = np.empty((len(names), len(features)))
+        missing = np.zeros((len(names), len(features)), dtype=bool)
+        objects = {}
+        bools = []
+
+        for j, feature in enumerate(features):
+
+            values = [record[feature] for record in records]
+            column, missing[:, j] = _to_float_column(values)
+
+            if column is None:
+                objects[feature] = np.array(values, dtype=object)
+                matrix[:, j] = np.nan
+                continue
+
+            if all(isinstance(value, bool) or value == 'NaN'
+                   for value in values):
+                bools.append(feature)
+
+            matrix[:, j] = column
+
+        return cls(names, features, matrix, missing, objects, bools)
+
+    @classmethod
+    def from_dataframe(cls, dataframe):
+
+        """
+
+            This function builds a ColumnarDataset from a pandas
+            dataframe with names in the first column (as returned
+            by dict_parser.convert_into_df), without going through
+            a Python dictionary. NaN values are stored as missing.
+
+            Args:
+                - dataframe: a pandas dataframe
+
+            Returns:
+                - dataset: a ColumnarDataset
+
+        """
+
+        names = dataframe.iloc[:, 0].values.tolist()
+        features = dataframe.columns.values.tolist()[1:]
+
+        matrix = np.empty((len(names), len(features)))
+        missing = np.zeros((len(names), len(features)), dtype=bool)
+        objects = {}
+        bools = []
+
+        for j, feature in enumerate(features):
+
+            values = dataframe.iloc[:, j + 1].values
+
+            if values.dtype.kind in 'fiub':
+                matrix[:, j] = values
+                missing[:, j] = np.isnan(matrix[:, j])
+                if values.dtype.kind == 'b':
+                    bools.append(feature)
+                continue
+
+            column = values.astype(object)
+            nan = np.array([isinstance(value, float) and value != value
+                            for value in column], dtype=bool)
+            column[nan] = 'NaN'
+            objects[feature] = column
+            missing[:, j] = nan
+            matrix[:, j] = np.nan
+
+        return cls(names, features, matrix, missing, objects, bools)
+
+    ### MAPPING FACADE ###
+
+    def __getitem__(self, name):
+        return _RecordView(self, self._rows[name])
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def __repr__(self):
+        return 'ColumnarDataset(%d names x %d features)' \
+            % (len(self._names), len(self._features))
+
+    ### COLUMN ACCESS ###
+
+    def row(self, name):
+
+        """ The row index of a name. """
+
+        return self._rows[name]
+
+    @property
+    def feature_names(self):
+        return list(self._features)
+
+    @property
+    def nbytes(self):
+
+        """ Memory used by the arrays of the dataset, in bytes. """
+
+        return self._matrix.nbytes + self._missing_bits.nbytes \
+            + sum(column.nbytes for column in self._objects.values())
+
+    def missing(self, feature):
+
+        """
+
+            This function returns a boolean array marking the 'NaN'
+            values of a feature, in row order.
+
+        """
+
+        bits = np.unpackbits(self._missing_bits[self._columns[feature]])
+        return bits[:len(self._names)].astype(bool)
+
+    def counts(self):
+
+        """
+
+            This function returns the number of non-missing values
+            of every feature (and of 'name'), as pandas'
+            DataFrame.count does on dict_parser.convert_into_df.
+
+            Returns:
+                - counts: a pandas Series indexed by feature
+
+        """
+
+        import pandas as pd
+
+        counts = (~np.isnan(self._matrix)).sum(axis=0)
+        for feature, column in self._objects.items():
+            counts[self._columns[feature]] = \
+                len(column) - pd.isnull(column).sum()
+
+        return pd.Series([len(self._names)] + counts.tolist(),
+                         index = ['name'] + self._features)
+
+    def column(self, feature, remove_NaN = False):
+
+        """
+
+            This function returns a feature as a numpy array, in row
+            order, without copying the matrix if possible.
+
+            Args:
+                - feature: a string
+                - remove_NaN: a boolean. If True, 'NaN' values are
+                              returned as 0 (as in featureFormat),
+                              otherwise as NaN
+
+            Returns:
+                - column: a numpy array (an object array for
+                          non-numeric features)
+
+        """
+
+        if feature in self._objects:
+            return self._objects[feature]
+
+        column = self._matrix[:, self._columns[feature]]
+
+        if remove_NaN:
+            missing = self.missing(feature)
+            if missing.any():
+                column = np.where(missing, 0., column)
+
+        return column
+
+    def feature_matrix(self, keys, features, remove_NaN = True):
+
+        """
+
+            This function returns the (keys x features) float matrix
+            that featureFormat builds from a data dictionary.
+
+            Args:
+                - keys: a list of names, i.e. the row order
+                - features: a list of feature names
+                - remove_NaN: a boolean. If True, 'NaN' values are
+                              converted to 0
+
+            Returns:
+                - matrix: a numpy array
+
+            Raises KeyError if a name or a feature is not present,
+            and ValueError if a feature is not numeric.
+
+        """
+
+        keys = list(keys)
+        if keys == self._names:
+            rows = slice(None)
+        else:
+            rows = np.array([self._rows[key] for key in keys], dtype=int)
+
+        matrix = np.empty((len(keys), len(features)))
+
+        for j, feature in enumerate(features):
+
+            if feature in self._objects:
+                values = self._objects[feature][rows]
+                if remove_NaN:
+                    values = [0 if value == 'NaN' else value
+                              for value in values]
+                matrix[:, j] = np.array(values, dtype=float)
+            else:
+                matrix[:, j] = self.column(feature, remove_NaN)[rows]
+
+        return matrix
+
+    ### CONVERSION ###
+
+    def value(self, row, feature):
+
+        """ The value of a single cell, formatted as in the dictionary. """
+
+        if feature in self._objects:
+            return self._objects[feature][row]
+
+        j = self._columns[feature]
+        if (self._missing_bits[j, row >> 3] >> (7 - (row & 7))) & 1:
+            return 'NaN'
+
+        value = self._matrix[row, j]
+        if feature in self._bools:
+            return bool(value)
+
+        return float(value)
+
+    def to_dict(self):
+
+        """
+
+            This function returns the dataset as a Python dictionary
+            formatted as the Enron dataset. Numeric values are
+            returned as floats.
+
+        """
+
+        columns = []
+        for feature in self._features:
+
+            if feature in self._objects:
+                columns.append(list(self._objects[feature]))
+                continue
+
+            column = self._matrix[:, self._columns[feature]]
+            if feature in self._bools:
+                column = column.astype(bool)
+            column = column.astype(object)
+            column[self.missing(feature)] = 'NaN'
+            columns.append(column.tolist())
+
+        return dict((name, dict(zip(self._features, values)))
+                    for name, values in zip(self._names, zip(*columns)))
+
+
+    ### PERSISTENCE ###
+
+    def _missing_matrix(self):
+
+        """ The (names x features) boolean matrix of 'NaN' cells. """
+
+        bits = np.unpackbits(self._missing_bits, axis=1)
+        return bits[:, :len(self._names)].T.astype(bool)
+
+    def save(self, directory):
+
+        """
+
+            This function saves the dataset to a folder: the matrix
+            and the packed bitmask as .npy files, names, features
+            and object columns as json.
+
+            Args:
+                - directory: a string, i.e. the path of the folder
+
+        """
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        np.save(os.path.join(directory, 'matrix.npy'), self._matrix)
+        np.save(os.path.join(directory, 'missing.npy'), self._missing_bits)
+
+        meta = {'names': self._names,
+                'features': self._features,
+                'objects': dict((feature, column.tolist())
+                                for feature, column
+                                in self._objects.items()),
+                'bools': sorted(self._bools)}
+
+        with open(os.path.join(directory, 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+    @classmethod
+    def load(cls, directory, mmap_mode = 'r'):
+
+        """
+
+            This function loads a dataset saved with save.
+
+            Args:
+                - directory: a string, i.e. the path of the folder
+                - mmap_mode: the mmap_mode used by np.load for the
+                             matrix. Set it to None to load it in
+                             memory
+
+            Returns:
+                - dataset: a ColumnarDataset
+
+        """
+
+        with open(os.path.join(directory, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+
+        names = meta['names']
+        matrix = np.load(os.path.join(directory, 'matrix.npy'),
+                         mmap_mode = mmap_mode)
+        bits = np.load(os.path.join(directory, 'missing.npy'))
+        missing = np.unpackbits(bits, axis=1)[:, :len(names)].T
+
+        objects = dict((feature, np.array(column, dtype=object))
+                       for feature, column in meta['objects'].items())
+
+        return cls(names, meta['features'], matrix, missing,
+                   objects, meta['bools'])
+
+    @classmethod
+    def concatenate(cls, datasets):
+
+        """
+
+            This function stacks datasets with the same features,
+            one after the other.
+
+            Args:
+                - datasets: a list of ColumnarDataset
+
+            Returns:
+                - dataset: a ColumnarDataset
+
+        """
+
+        datasets = list(datasets)
+        features = datasets[0]._features
+
+        for dataset in datasets[1:]:
+            if dataset._features != features:
+                raise ValueError('datasets do not have the same features')
+
+        names = [name for dataset in datasets for name in dataset._names]
+        matrix = np.vstack([dataset._matrix for dataset in datasets])
+        missing = np.vstack([dataset._missing_matrix()
+                             for dataset in datasets])
+        objects = dict((feature,
+                        np.concatenate([dataset._objects[feature]
+                                        for dataset in datasets]))
+                       for feature in datasets[0]._objects)
+
+        return cls(names, features, matrix, missing,
+                   objects, datasets[0]._bools)
+
+
+    ### UPDATE ###
+
+    def _reserve(self, n_rows):
+
+        """
+
+            This function makes sure the arrays of the dataset can
+            take n_rows rows in place: they become views on buffers
+            (writable, e.g. not memory-mapped) whose capacity is
+            doubled when it is too small, so that appending rows
+            copies the dataset only O(log n) times.
+
+        """
+
+        buffers = getattr(self, '_buffers', None)
+        if buffers is not None and len(buffers[0]) >= n_rows:
+            return
+
+        n_names = len(self._names)
+        capacity = max(n_rows, 2 * n_names, 8)
+
+        matrix = np.empty((capacity, len(self._features)))
+        matrix[:n_names] = self._matrix
+
+        bits = np.zeros((len(self._features), (capacity + 7) // 8),
+                        dtype=np.uint8)
+        bits[:, :self._missing_bits.shape[1]] = self._missing_bits
+
+        objects = {}
+        for feature, column in self._objects.items():
+            objects[feature] = np.empty(capacity, dtype=object)
+            objects[feature][:n_names] = column
+
+        self._buffers = matrix, bits, objects
+        self._resize(n_names)
+
+    def _resize(self, n_rows):
+
+        """ Point the arrays of the dataset at n_rows of the buffers. """
+
+        matrix, bits, objects = self._buffers
+
+        self._matrix = matrix[:n_rows]
+        self._missing_bits = bits[:, :(n_rows + 7) // 8]
+        self._objects = dict((feature, column[:n_rows])
+                             for feature, column in objects.items())
+
+    def upsert(self, other):
+
+        """
+
+            This function updates the dataset in place: the rows of
+            other replace the rows with the same name, and the other
+            rows of other are appended at the end. Only the rows of
+            other are written (missing values are copied bit by bit
+            in the packed bitmask), so the cost is proportional to
+            the size of other.
+
+            Args:
+                - other: a ColumnarDataset with the same features
+
+            Returns:
+                - self
+
+        """
+
+        if other._features != self._features:
+            raise ValueError('datasets do not have the same features')
+
+        n_names = len(self._names)
+        targets = np.empty(len(other._names), dtype=int)
+        appended = []
+
+        for i, name in enumerate(other._names):
+            row = self._rows.get(name)
+            if row is None:
+                row = n_names + len(appended)
+                appended.append(name)
+                # A name repeated in other is appended once
+                self._rows[name] = row
+            targets[i] = row
+
+        self._reserve(n_names + len(appended))
+        self._names.extend(appended)
+        self._resize(len(self._names))
+
+        matrix, bits, objects = self._buffers
+        sources = np.arange(len(other._names))
+
+        matrix[targets] = other._matrix
+
+        # Bits of the rows of other, cleared then set in the rows of
+        # the dataset (ufunc.at, as targets can share a byte)
+        source_bits = (other._missing_bits[:, sources >> 3]
+                       >> (7 - (sources & 7)).astype(np.uint8)) & 1
+        masks = (1 << (7 - (targets & 7))).astype(np.uint8)
+        columns = (slice(None), targets >> 3)
+        np.bitwise_and.at(bits, columns, ~masks)
+        np.bitwise_or.at(bits, columns, source_bits * masks)
+
+        for feature, column in objects.items():
+            column[targets] = other._objects[feature]
+
+        return self
+
+
+class _RecordView(Mapping):
+
+    """ Read-only {feature: value} view on one row of a dataset. """
+
+    def __init__(self, dataset, row):
+        self._dataset = dataset
+        self._row = row
+
+    def __getitem__(self, feature):
+        if feature not in self._dataset._columns:
+            raise KeyError(feature)
+        return self._dataset.value(self._row, feature)
+
+    def __iter__(self):
+        return iter(self._dataset._features)
+
+    def __len__(self):
+        return len(self._dataset._features)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+###############################################################
+
+### ON-DISK STORE ###
+
+# A store is a folder of parts, each part being a ColumnarDataset
+# saved with ColumnarDataset.save. Parts are appended one at a time,
+# so a dataset larger than memory can be written in chunks. The
+# features of the store are saved once, in schema.json.
+
+# Features of the stores already read or written, by path
+_STORE_FEATURES = {}
+
+def _schema_path(store_dir):
+
+    return os.path.join(store_dir, 'schema.json')
+
+
+def store_features(store_dir):
+
+    """
+
+        This function returns the features of a store (None if it
+        has no parts), reading its schema once per process.
+
+    """
+
+    key = os.path.abspath(store_dir)
+
+    if key not in _STORE_FEATURES:
+
+        if os.path.exists(_schema_path(store_dir)):
+            with open(_schema_path(store_dir)) as schema_file:
+                features = json.load(schema_file)['features']
+        else:
+            parts = store_parts(store_dir)
+            if not parts:
+                return None
+            # A store written before schema.json
+            features = ColumnarDataset.load(parts[0]).feature_names
+
+        _STORE_FEATURES[key] = features
+
+    return _STORE_FEATURES[key]
+
+
+def clear_store(store_dir):
+
+    """
+
+        This function removes the parts and the schema of a store
+        (other files of the folder are left alone).
+
+    """
+
+    _STORE_FEATURES.pop(os.path.abspath(store_dir), None)
+
+    for part_dir in store_parts(store_dir):
+        shutil.rmtree(part_dir)
+
+    if os.path.exists(_schema_path(store_dir)):
+        os.remove(_schema_path(store_dir))
+
+
+def append_to_store(store_dir, dataset):
+
+    """
+
+        This function appends a dataset to an on-disk store as a
+        new part.
+
+        Args:
+            - store_dir: a string, i.e. the path of the store
+            - dataset: a ColumnarDataset
+
+        Returns:
+            - part_dir: a string, i.e. the folder of the new part
+
+    """
+
+    features = store_features(store_dir)
+
+    if features is None:
+
+        if not os.path.isdir(store_dir):
+            os.makedirs(store_dir)
+
+        features = dataset.feature_names
+        with open(_schema_path(store_dir), 'w') as schema_file:
+            json.dump({'features': features}, schema_file)
+        _STORE_FEATURES[os.path.abspath(store_dir)] = features
+
+    elif features != dataset.feature_names:
+        raise ValueError('dataset does not have the same features '
+                         'as the store')
+
+    parts = store_parts(store_dir)
+    part_dir = os.path.join(store_dir, 'part-%05d' % len(parts))
+    dataset.save(part_dir)
+
+    return part_dir
+
+
+def store_parts(store_dir):
+
+    """ The sorted list of part folders of a store. """
+
+    if not os.path.isdir(store_dir):
+        return []
+
+    return [os.path.join(store_dir, part)
+            for part in sorted(os.listdir(store_dir))
+            if part.startswith('part-')]
+
+
+def iter_store(store_dir, mmap_mode = 'r'):
+
+    """
+
+        This function yields the parts of a store one at a time,
+        as memory-mapped ColumnarDataset.
+
+    """
+
+    for part_dir in store_parts(store_dir):
+        yield ColumnarDataset.load(part_dir, mmap_mode)
+
+
+def load_store(store_dir):
+
+    """
+
+        This function loads a whole store as a single
+        ColumnarDataset (in memory).
+
+    """
+
+    return ColumnarDataset.concatenate(iter_store(store_dir))
@@ -10,6 +10,10 @@
     a parsed Python data dictionary, after having performed a
     series of operations on a pandas datafarme.
 
+    parse can also return the parsed pandas dataframe, a
+    ColumnarDataset or labels/features arrays directly, skipping
+    the data dictionary.
+
     The module also imports pandas, numpy and math.
 
 """
@@ -17,7 +21,12 @@
 import pandas as pd
 import numpy as np
 import math
+import multiprocessing
+from operator import itemgetter
+from collections import OrderedDict
 import variable_adder
+from dataset_store import ColumnarDataset
+from feature_format import featureFormat, targetFeatureSplit
 
 ###############################################################
 
@@ -53,7 +62,7 @@ def extract_fields_from_dict(data_dict):
 
     return fields
 
-def convert_into_df(data_dict):
+def convert_into_df(data_dict, fields = None):
 
     """
 
@@ -62,6 +71,9 @@ def convert_into_df(data_dict):
 
         Args:
             - data_dict: a Python dictionary
+            - fields: a list of variable names, 'name' first. By
+                      default they are extracted from data_dict
+                      with extract_fields_from_dict
 
         Returns:
             - dataframe: a pandas dataframe
@@ -69,33 +81,47 @@ def convert_into_df(data_dict):
         This function takes a data dictionary formatted as the
         Enron one and returns a pandas dataframe.
 
+        The dataframe is built one column at a time: values are
+        looked up by key, so sub-dictionaries do not need to share
+        the same key order ('NaN' is used for a missing key).
+        Numeric columns are float64 (NaN for missing values) and
+        email_address is an object column.
+
     """
 
     # Extract fields to be used as columns in the dataframe
-    fields = extract_fields_from_dict(data_dict)
-
-
-    # Initialise the values list, i.e. a list of lists
+    if fields is None:
+        fields = extract_fields_from_dict(data_dict)
+
+    names = list(data_dict.keys())
+    variables = [field for field in fields if field != 'name']
+
+    # Transpose the records into one tuple of values per variable
+    # in a single pass
+    try:
+        getter = itemgetter(*variables)
+        rows = [getter(data_dict[name]) for name in names]
+        values = zip(*rows) if len(variables) > 1 else [rows]
+    except (KeyError, TypeError):
+        values = [[data_dict[name].get(variable, 'NaN') for name in names]
+                  for variable in variables]
+
+    # Build typed columns directly, rather than a list of lists
     # for all observations
-    values = []
+    columns = {'name' : names}
 
-    for name, dictionary in data_dict.items():
+    for variable, column in zip(variables, values):
 
-        # Initialise the observation list and add name
-        # values immediately
-        obs_list = [name]
+        column = np.array(column, dtype=object)
 
-        for key, value in dictionary.items():
-
-            if key == 'email_address':
-                obs_list.append(value)
-            else:
-                obs_list.append(float(value))
-
-        values.append(obs_list)
+        if variable == 'email_address':
+            columns[variable] = column
+        else:
+            column[column == 'NaN'] = np.nan
+            columns[variable] = column.astype(float)
 
     # Initialise pandas dataframe
-    dataframe = pd.DataFrame(values, columns = fields)
+    dataframe = pd.DataFrame(columns, columns = fields)
 
     return dataframe
 
@@ -138,7 +164,7 @@ def remove_outliers(dataframe, outliers):
 # The funtion write_dictionary converts a pandas dataframe
 # into a Python dictionary formatted as the Enron dataset.
 
-def write_dictionary(dataframe):
+def write_dictionary(dataframe, as_columnar = False):
     
     """
 
@@ -146,46 +172,50 @@ def write_dictionary(dataframe):
         as the Enron dataset.
 
         Args:
-            - dataframe: a pandas DataFrame
+            - dataframe: a pandas DataFrame, with names in the
+                         first column
+            - as_columnar: a boolean. If True, a ColumnarDataset
+                           (see dataset_store) is returned instead,
+                           without building the nested dictionaries.
+                           It can be passed to featureFormat as is.
 
         Returns:
             - data_dict: a Python dictionary
 
     """
-    
-    # Initialise the dictionary
-    data_dict = {}
+
+    if as_columnar:
+        return ColumnarDataset.from_dataframe(dataframe)
     
     # Extract variable names
-    variables = dataframe.columns.values.tolist()
-    
-    # For loop to add items
-    for observation in dataframe.values.tolist():
-        
-        # Initialise the single observation dictionary
-        obs_dict = {}
-        
-        for i in range(1, len(variables)):
-            
-            value = observation[i]
-            
-            if isinstance(value, float):
-                
-                if math.isnan(value):
-                    
-                    obs_dict[variables[i]] = 'NaN'
-                    
-                else:
-                    
-                    obs_dict[variables[i]] = observation[i]
-            
-            else:
-                
-                obs_dict[variables[i]] = observation[i]
-            
-            
-        # Add item to data_dict
-        data_dict[observation[0]] = obs_dict
+    variables = dataframe.columns.values.tolist()[1:]
+
+    # Convert one column at a time, replacing NaN values with
+    # the 'NaN' string through a mask
+    columns = []
+    for i in range(1, len(variables) + 1):
+
+        values = dataframe.iloc[:, i].values
+        column = values.astype(object)
+
+        if values.dtype.kind == 'f':
+            column[np.isnan(values)] = 'NaN'
+        elif values.dtype.kind == 'O':
+            column[[isinstance(value, float) and math.isnan(value)
+                    for value in values]] = 'NaN'
+
+        columns.append(column.tolist())
+
+    names = dataframe.iloc[:, 0].values.tolist()
+
+    # Build all the observation dictionaries in bulk
+    if columns:
+        observations = [dict(zip(variables, observation))
+                        for observation in zip(*columns)]
+    else:
+        observations = [{} for _ in names]
+
+    data_dict = dict(zip(names, observations))
     
     return data_dict
     
@@ -201,7 +231,11 @@ def write_dictionary(dataframe):
 def parse(data_dict,
           outliers,
           adder_dictionary, 
-          log_sqrt = None):
+          log_sqrt = None,
+          output = 'dict',
+          features_list = None,
+          n_jobs = 1,
+          **format_options):
     
     """
         
@@ -217,38 +251,309 @@ def parse(data_dict,
             - outliers: a Python list
             - adder_dictionary: a Python dictionary
             - log_sqrt: a Python list. By default it is set to None
+            - output: a string, i.e. what is returned:
+                - 'dict' (default): a Python dictionary
+                - 'dataframe': the pandas dataframe with the
+                               added features
+                - 'columnar': a ColumnarDataset, i.e. a read-only
+                              mapping that featureFormat and
+                              dump_classifier_and_data accept in
+                              place of the dictionary
+                - 'arrays': labels, features and names for
+                            features_list, as featureFormat and
+                            targetFeatureSplit would return them
+            - features_list: a Python list, 'poi' first. If given,
+                             only the added variables it needs
+                             (directly or through other added
+                             variables) are computed. Required
+                             when output is 'arrays'
+            - n_jobs: an integer, i.e. the number of processes.
+                      If greater than 1 (or -1 for all the cores)
+                      the records are split into n_jobs shards that
+                      are converted, cleaned and extended in a
+                      process pool, then concatenated in order. The
+                      result is the same as with n_jobs = 1. Plans
+                      with transforms that are not row-local (e.g.
+                      rank) always run in a single process.
+                      Sharding is overhead-dominated: only the
+                      shard work runs in parallel, while starting
+                      the pool (0.1-0.2 s), unpickling the shard
+                      dataframes in the parent and write_dictionary
+                      stay serial. For 10**5 Enron-like records the
+                      shard work is ~0.3 s of a ~0.8 s parse into
+                      a dictionary, so no number of cores gives
+                      much more than 1.2x (see benchmark.py,
+                      bench_parse_stages). Without the dictionary
+                      (output 'dataframe'), sharding breaks even
+                      at about 10**5 records on 4 cores and gives
+                      ~2x from 3 * 10**5 records on 8 cores. Keep
+                      n_jobs = 1 below 10**5 records
+            - format_options: keyword arguments of featureFormat
+                              (e.g. sort_keys). Only used when output
+                              is 'arrays'
 
         Returns:
-            - data_dict: a Python dictionary
+            - data_dict: a Python dictionary (or the output selected
+                         above)
         
     
     """
+
+    if output not in ('dict', 'dataframe', 'columnar', 'arrays'):
+        raise ValueError('Unknown output: %s' % output)
+
+    if output == 'arrays' and not features_list:
+        raise ValueError("features_list is required for output 'arrays'")
+    
+    # Variables to add, restricted to features_list if given
+    plan = variable_adder.compile_plan(adder_dictionary,
+                                       log_sqrt,
+                                       features_list)
+
+    if n_jobs == -1:
+        n_jobs = multiprocessing.cpu_count()
+
+    # Ranks and quantiles need the whole population at once
+    if n_jobs > 1 and variable_adder.is_row_local(plan):
+
+        dataframe = _parse_sharded(data_dict,
+                                   outliers,
+                                   plan,
+                                   n_jobs)
+
+    else:
+
+        dataframe = _parse_shard((data_dict,
+                                  None,
+                                  0,
+                                  outliers,
+                                  plan))
+
+    if output == 'dataframe':
+        return dataframe
+
+    if output == 'columnar':
+        return write_dictionary(dataframe, as_columnar = True)
+
+    if output == 'arrays':
+        return dataframe_to_arrays(dataframe,
+                                   features_list,
+                                   **format_options)
+    
+    # Returnd dictionary
+    data_dict = write_dictionary(dataframe)
     
+    return data_dict
+
+
+def _parse_shard(arguments):
+
+    """
+
+        This function converts a data dictionary into a dataframe,
+        removes the outliers and adds the variables. Its index
+        starts at the given offset.
+
+    """
+
+    data_dict, fields, offset, outliers, plan = arguments
+
     # Convert data_dict into dataframe
-    dataframe = convert_into_df(data_dict)
+    dataframe = convert_into_df(data_dict, fields)
+    if offset:
+        dataframe.index = dataframe.index + offset
     
     # Remove outliers
     dataframe = remove_outliers(dataframe, outliers)
     
     # Add variables
-    dataframe = variable_adder.add_all(dataframe,
-                                       adder_dictionary,
-                                       log_sqrt)
-    
-    # Returnd dictionary
-    data_dict = write_dictionary(dataframe)
-    
-    return data_dict
+    dataframe = variable_adder.execute_plan(dataframe, plan)
+
+    return dataframe
+
+
+# Records, names and instructions shared with the pool workers
+_SHARD_SOURCE = None
+
+def _set_shard_source(source):
+
+    global _SHARD_SOURCE
+    _SHARD_SOURCE = source
+
+
+def _parse_shard_range(bounds):
+
+    """
+
+        This function runs _parse_shard on the records between two
+        positions of the shared names list.
+
+    """
+
+    data_dict, names, fields, outliers, plan = _SHARD_SOURCE
+    start, end = bounds
+
+    # Ordered shards keep the rows in the serial order
+    shard = OrderedDict((name, data_dict[name])
+                        for name in names[start:end])
+
+    return _parse_shard((shard, fields, start, outliers, plan))
+
+
+def _parse_sharded(data_dict,
+                   outliers,
+                   plan,
+                   n_jobs):
+
+    """
+
+        This function runs _parse_shard on n_jobs contiguous shards
+        of data_dict in a process pool, and concatenates the
+        dataframes in the serial order.
+
+        The records reach the workers through the pool initializer,
+        i.e. they are inherited (not pickled) where processes are
+        forked.
+
+    """
+
+    names = list(data_dict.keys())
+    fields = extract_fields_from_dict(data_dict)
+
+    n_shards = max(1, min(n_jobs, len(names)))
+    bounds = np.linspace(0, len(names), n_shards + 1).astype(int)
+    ranges = [(int(start), int(end))
+              for start, end in zip(bounds[:-1], bounds[1:])]
+
+    source = (data_dict, names, fields, outliers, plan)
+
+    pool = multiprocessing.Pool(n_jobs,
+                                initializer = _set_shard_source,
+                                initargs = (source,))
+    try:
+        dataframes = pool.map(_parse_shard_range, ranges)
+    finally:
+        pool.close()
+        pool.join()
+
+    # The plan is an ordered list, so every shard has the same
+    # columns in the same order
+    return pd.concat(dataframes)
+
+
+def dataframe_to_arrays(dataframe, features_list, **format_options):
+
+    """
+
+        This function returns labels, features and names straight
+        from a parsed dataframe, without building the data
+        dictionary.
+
+        Args:
+            - dataframe: a pandas dataframe, names in the first column
+            - features_list: a Python list, 'poi' first
+            - format_options: keyword arguments of featureFormat
+
+        Returns:
+            - labels, features: numpy arrays, as returned by
+                                targetFeatureSplit(as_arrays = True)
+            - names: a Python list, i.e. the name of every row
+
+    """
+
+    dataset = ColumnarDataset.from_dataframe(dataframe)
+
+    data, names = featureFormat(dataset,
+                                features_list,
+                                return_keys = True,
+                                **format_options)
+
+    labels, features = targetFeatureSplit(data, as_arrays = True)
+
+    return labels, features, names
 
 ###############################################################
 
 ### ALGORITHM FIELDS ###
 
+# Missing-value profiles of the datasets given a version, most
+# recently used last, keyed by (id of the dataset, its length,
+# version). Only the profiles are kept, not the datasets
+MAX_MISSING_PROFILES = 16
+_MISSING_PROFILES = OrderedDict()
+
+def clear_missing_profiles():
+
+    """ This function drops the memoized missing-value profiles. """
+
+    _MISSING_PROFILES.clear()
+
+
+def _compute_missing_profile(data_dict):
+
+    """ The proportion of missing values of every variable. """
+
+    if isinstance(data_dict, ColumnarDataset):
+        counts = data_dict.counts()
+        return 1 - counts / float(len(data_dict))
+
+    dataset = convert_into_df(data_dict)
+    return 1 - dataset.count() / float(len(dataset))
+
+
+def missing_profile(data_dict, version = None):
+
+    """
+
+        This function returns the proportion of missing values of
+        every variable of a dataset, computed in a single pass.
+
+        By default the dataset is read on every call. A caller
+        that queries the same dataset repeatedly can pass a
+        version: the profile is then memoized under the identity,
+        length and version of the dataset (the last
+        MAX_MISSING_PROFILES profiles are kept), and the dataset is
+        not read again for that version. The caller must change the
+        version whenever the dataset is changed in place.
+
+        Args:
+            - data_dict: a Python dictionary or a ColumnarDataset
+            - version: a hashable, e.g. a counter bumped by the
+                       caller every time data_dict is changed, or
+                       None (not memoized)
+
+        Returns:
+            - nan_perc: a pandas Series indexed by variable name
+                        ('name' included)
+
+    """
+
+    if version is None:
+        return _compute_missing_profile(data_dict)
+
+    key = (id(data_dict), len(data_dict), version)
+
+    if key in _MISSING_PROFILES:
+        # Most recently used last
+        nan_perc = _MISSING_PROFILES.pop(key)
+        _MISSING_PROFILES[key] = nan_perc
+        return nan_perc
+
+    nan_perc = _compute_missing_profile(data_dict)
+
+    _MISSING_PROFILES[key] = nan_perc
+    while len(_MISSING_PROFILES) > MAX_MISSING_PROFILES:
+        _MISSING_PROFILES.popitem(last = False)
+
+    return nan_perc
+
+
 def extract_fields_for_ml(data_dict,
                           threshold = 0.5,
                           exclude = ['name',
                                      'email_address',
-                                     'poi']):
+                                     'poi'],
+                          version = None):
 
     """
 
@@ -264,32 +569,59 @@ def extract_fields_for_ml(data_dict,
                        which are not included in the analysis.
                        By default, they are 'name', 'email_address',
                        and 'poi'.
+            - version: a hashable, as in missing_profile
 
         Returns:
             - var_list: a Python list.
 
+        The dataset is read on every call, unless a version is
+        given (see missing_profile). To compare several thresholds,
+        use sweep_fields_for_ml, which reads it once.
+
     """
 
-    # Extract fields
-    fields = extract_fields_from_dict(data_dict)
+    return sweep_fields_for_ml(data_dict,
+                               [threshold],
+                               exclude,
+                               version)[threshold]
 
-    # Extract variables to be used in the analysis
-    variables = [x for x in fields if x not in exclude]
 
-    # Create dataset
-    dataset = convert_into_df(data_dict)
+def sweep_fields_for_ml(data_dict,
+                        thresholds,
+                        exclude = ['name',
+                                   'email_address',
+                                   'poi'],
+                        version = None):
 
-    # Create pandas dataframe
-    nan_df = pd.DataFrame(variables, columns=['variable'])
+    """
+
+        This function returns the list of features selected by
+        extract_fields_for_ml for each of a series of thresholds,
+        reading the dataset once.
+
+        Args:
+            - data_dict: a Python dictionary
+            - thresholds: a list of floats
+            - exclude: a Python list, as in extract_fields_for_ml
+            - version: a hashable, as in missing_profile
+
+        Returns:
+            - var_lists: a Python dictionary {threshold: var_list}
+
+    """
 
-    # Calculate percentage of NaN
-    nan_df['nan_perc'] = [(1 - (float(dataset[x].count()) \
-        / len(dataset))) for x in nan_df['variable']]
+    nan_perc = missing_profile(data_dict, version)
 
-    # List of variables
-    var_list = ['poi'] \
-        + nan_df[nan_df['nan_perc'] < threshold]['variable'].tolist()
+    # Variables to be used in the analysis
+    nan_perc = nan_perc[[x not in exclude for x in nan_perc.index]]
+    variables = np.array(nan_perc.index.tolist(), dtype=object)
 
-    return var_list
+    # One row per threshold, one column per variable
+    selected = nan_perc.values[np.newaxis, :] \
+        < np.asarray(thresholds, dtype=float)[:, np.newaxis]
 
+    var_lists = {}
+    for threshold, mask in zip(thresholds, selected):
+        var_lists[threshold] = ['poi'] + variables[mask].tolist()
 
+    return var_lists
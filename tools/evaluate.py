@@ -6,11 +6,12 @@
 """
 
 import sys
-import numpy as np
 import pandas as pd
-from sklearn.cross_validation import StratifiedShuffleSplit
-from sklearn.metrics import accuracy_score, precision_score, \
-                            recall_score, f1_score, roc_auc_score
+
+from cv_engine import evaluate_folds, evaluate_folds_sequential, \
+                      evaluate_folds_shared, make_folds, \
+                      pooled_scores, mean_scores
+from fold_store import collect_folds
 
 #####################################
 ### EVALUATE SINGLE CLASSIFIER ###
@@ -19,7 +20,8 @@ from sklearn.metrics import accuracy_score, precision_score, \
 
 def eval_clf(clf_best,
 			 features,
-			 labels):
+			 labels,
+			 n_jobs = 1):
     
     """
     
@@ -30,51 +32,17 @@ def eval_clf(clf_best,
             - clf_best: a classifier
             - features, labels: array of features,
             					labels extracted from the dataset.
+            - n_jobs: an integer, i.e. the number of processes
+            		  the folds are run in (see cv_engine)
                                 
         Returns:
-            - list of scores
+            - list of scores, averaged over the samples
         
     """
     
-    # Define cv object
-    cv = StratifiedShuffleSplit(labels, 1000, random_state=42)
-    
-    accuracy = []
-    precision = []
-    recall = []
-    f1 = []
-    
-    for train_idx, test_idx in cv:
-        
-        features_train = []
-        features_test  = []
-        labels_train   = []
-        labels_test    = []
-        for ii in train_idx:
-            features_train.append( features[ii] )
-            labels_train.append( labels[ii] )
-        for jj in test_idx:
-            features_test.append( features[jj] )
-            labels_test.append( labels[jj] )
-            
-        
-        ### fit the classifier using training set,
-        #and test on test set
-        clf_best.fit(features_train, labels_train)
-        predictions = clf_best.predict(features_test)
-        probabs = clf_best.predict_proba(features_test)
-        
-        accuracy.append(accuracy_score(labels_test, predictions))
-        precision.append(precision_score(labels_test, predictions))
-        recall.append(recall_score(labels_test, predictions))
-        f1.append(f1_score(labels_test, predictions))
-        
-    accuracy = np.array(accuracy).mean()
-    precision = np.array(precision).mean()
-    recall = np.array(recall).mean()
-    f1 = np.array(f1).mean()
-    
-    return [accuracy, precision, recall, f1]
+    records = evaluate_folds(clf_best, features, labels, n_jobs = n_jobs)
+
+    return mean_scores(records)
 
 #####################################
 ### EVALUATE SINGLE CLASSIFIER ###
@@ -84,7 +52,8 @@ def eval_clf(clf_best,
 
 def eval_clf_tester(clf_best,
 					features,
-					labels):
+					labels,
+					n_jobs = 1):
     
     """
     
@@ -95,6 +64,8 @@ def eval_clf_tester(clf_best,
             - clf_best: a classifier
             - features, labels: array of features,
             					labels extracted from the dataset.
+            - n_jobs: an integer, i.e. the number of processes
+            		  the folds are run in (see cv_engine)
                                 
         Returns:
             - list of scores, where metrics are calculated as in
@@ -102,58 +73,94 @@ def eval_clf_tester(clf_best,
         
     """
 
-    # Define cv object
-    cv = StratifiedShuffleSplit(labels, 1000, random_state=42)
-
-    true_negatives = 0
-    false_negatives = 0
-    true_positives = 0
-    false_positives = 0
-    for train_idx, test_idx in cv: 
-        features_train = []
-        features_test  = []
-        labels_train   = []
-        labels_test    = []
-        for ii in train_idx:
-            features_train.append( features[ii] )
-            labels_train.append( labels[ii] )
-        for jj in test_idx:
-            features_test.append( features[jj] )
-            labels_test.append( labels[jj] )
-        
-        # fit the classifier using training set,
-        # and test on test set
-        clf_best.fit(features_train, labels_train)
-        predictions = clf_best.predict(features_test)
-        for prediction, truth in zip(predictions, labels_test):
-            if prediction == 0 and truth == 0:
-                true_negatives += 1
-            elif prediction == 0 and truth == 1:
-                false_negatives += 1
-            elif prediction == 1 and truth == 0:
-                false_positives += 1
-            elif prediction == 1 and truth == 1:
-                true_positives += 1
-            
-    
-    total_predictions = true_negatives \
-    					+ false_negatives \
-    					+ false_positives \
-    					+ true_positives
+    records = evaluate_folds(clf_best, features, labels, n_jobs = n_jobs)
+
+    return pooled_scores(records)
+
+
+#####################################
+### STORE FOLD PREDICTIONS ###
+# This function keeps the predictions of every fold, so that
+# scores can be computed again without refitting.
 
-    accuracy = 1.0*(true_positives + true_negatives)\
-    		   /total_predictions
+def eval_clf_store(clf_best,
+				   features,
+				   labels,
+				   path = None,
+				   n_jobs = 1):
 
-    precision = 1.0*true_positives\
-    			/(true_positives+false_positives)
+    """
 
-    recall = 1.0*true_positives\
-    		 /(true_positives+false_negatives)
+        This function fits a classification algorithm over a
+        series of stratified samples and stores its predictions.
 
-    f1 = 2.0 * true_positives\
-    	 /(2*true_positives + false_positives+false_negatives)
+        Args:
+            - clf_best: a classifier
+            - features, labels: array of features,
+            					labels extracted from the dataset.
+            - path: a string. If given, the store is saved there
+            		(see fold_store.FoldStore.save)
+            - n_jobs: an integer, i.e. the number of processes
+            		  the folds are run in (see cv_engine)
+
+        Returns:
+            - store: a FoldStore, e.g. store.scores() gives the
+            		 scores of eval_clf_tester, and
+            		 store.scores(how = 'mean') those of eval_clf
+
+    """
 
-    return [accuracy, precision, recall, f1]
+    store = collect_folds(clf_best, features, labels, n_jobs = n_jobs)
+
+    if path is not None:
+        store.save(path)
+
+    return store
+
+
+#####################################
+### TUNE DECISION THRESHOLD ###
+
+def sweep_threshold(clf_best,
+					features,
+					labels,
+					metric = 'f1',
+					min_precision = 0.3,
+					min_recall = 0.3,
+					n_jobs = 1):
+
+    """
+
+        This function fits a classification algorithm over a
+        series of stratified samples once, then scores every
+        decision threshold of its probabilities.
+
+        Args:
+            - clf_best: a classifier with predict_proba
+            - features, labels: array of features,
+            					labels extracted from the dataset.
+            - metric: a string, i.e. the score to maximise
+            - min_precision, min_recall: floats or None, i.e. the
+            		  minimum scores of the chosen threshold
+            - n_jobs: an integer, i.e. the number of processes
+            		  the folds are run in (see cv_engine)
+
+        Returns:
+            - sweep: a dictionary with the scores of every
+            		 threshold (see FoldStore.threshold_sweep)
+            - best: a dictionary, i.e. the best threshold and its
+            		scores (None if no threshold meets the minimums)
+
+    """
+
+    store = collect_folds(clf_best, features, labels, n_jobs = n_jobs)
+
+    sweep = store.threshold_sweep()
+
+    return sweep, store.best_threshold(metric,
+                                       min_precision,
+                                       min_recall,
+                                       sweep)
 
 
 #####################################
@@ -162,7 +169,10 @@ def eval_clf_tester(clf_best,
 def evaluate_clf_list(clfs_list,
                       features,
                       labels,
-                      tester):
+                      tester,
+                      n_jobs = 1,
+                      early_stopping = False,
+                      threshold = 0.3):
     
     """
     
@@ -175,7 +185,17 @@ def evaluate_clf_list(clfs_list,
             					from the dataset.
             - tester: a boolean. If true, the evaluation applied
             		  is the one provided in the course using
-            		  tester.py
+            		  tester.py. If 'both', the scores of tester.py
+            		  are followed by the averaged ones, computed
+            		  from the same fits
+            - n_jobs: an integer, i.e. the number of processes
+            		  the folds are run in (see cv_engine)
+            - early_stopping: a boolean. If True, folds are run in
+            		  batches until precision and recall are known
+            		  to be above or below threshold, or known
+            		  precisely enough (see cv_engine). The number
+            		  of folds used is added at the end of the scores
+            - threshold: a float, used with early_stopping
                                 
         Returns:
             - clfs_names: list with names of classifiers
@@ -185,26 +205,72 @@ def evaluate_clf_list(clfs_list,
     
     clfs_names = []
     clfs_scores = []
+
+    # The same folds for every classifier
+    folds = make_folds(labels)
+
+    # In a single process, all the classifiers are run together
+    # fold by fold, fitting the scaler (and PCA) of a fold only
+    # once: progress is then reported once for all of them
+    shared = None
+    if not early_stopping and n_jobs == 1:
+
+        sys.stdout.write('%d classifiers in progress' % len(clfs_list))
+
+        shared = evaluate_folds_shared([clf['best_clf']
+                                        for clf in clfs_list],
+                                       features,
+                                       labels,
+                                       folds)
+
+        sys.stdout.write('...........Completed!\n')
     
-    for clf in clfs_list:
+    for i, clf in enumerate(clfs_list):
         
         # Extract name of classifier
         clfs_names.append(clf['name'])
         
-        sys.stdout.write('%s in progress' % clf['name'])
+        if shared is None:
+            sys.stdout.write('%s in progress' % clf['name'])
+
+        if shared is not None:
+
+            records = shared[i]
+
+        elif early_stopping:
+
+            records, _ = evaluate_folds_sequential(clf['best_clf'],
+                                                   features,
+                                                   labels,
+                                                   folds,
+                                                   threshold = threshold,
+                                                   n_jobs = n_jobs)
+
+        else:
+
+            records = evaluate_folds(clf['best_clf'],
+                                     features,
+                                     labels,
+                                     folds,
+                                     n_jobs = n_jobs)
         
-        if tester:
+        if tester == 'both':
+
+            clf_score = pooled_scores(records) + mean_scores(records)
+
+        elif tester:
             
-            clf_score = eval_clf_tester(clf['best_clf'],
-            							features,
-            							labels)
+            clf_score = pooled_scores(records)
+
         else:
 
-            clf_score = eval_clf(clf['best_clf'],
-                                     features,
-                                     labels)
+            clf_score = mean_scores(records)
+
+        if early_stopping:
+            clf_score = clf_score + [len(records)]
         
-        sys.stdout.write('...........Completed!\n') 
+        if shared is None:
+            sys.stdout.write('...........Completed!\n') 
         
         clfs_scores.append(clf_score)
         
@@ -221,7 +287,10 @@ def clf_ranking(clfs_list,
                 features,
                 labels,
                 by = 'f1',
-                tester = False):
+                tester = False,
+                n_jobs = 1,
+                early_stopping = False,
+                threshold = 0.3):
     
     """
     
@@ -236,7 +305,12 @@ def clf_ranking(clfs_list,
     			  f1 is the default.
             - tester: a boolean. If true, the evaluation applied
             		  is the one provided in the course using
-            		  tester.py
+            		  tester.py. If 'both', the averaged metrics
+            		  are added with a 'mean_' prefix
+            - n_jobs: an integer, i.e. the number of processes
+            		  the folds are run in (see cv_engine)
+            - early_stopping, threshold: see evaluate_clf_list. The
+            		  number of folds used is in the n_folds column
     
     """
     
@@ -244,13 +318,22 @@ def clf_ranking(clfs_list,
     names, scores = evaluate_clf_list(clfs_list,
                                       features = features,
                                       labels = labels,
-                                      tester = tester)
+                                      tester = tester,
+                                      n_jobs = n_jobs,
+                                      early_stopping = early_stopping,
+                                      threshold = threshold)
     
     # Initialise the ranking dataframe
     ranking = pd.DataFrame(names, columns =  ['name'])
     
     # Add values
     columns = ['accuracy', 'precision', 'recall','f1']
+
+    if tester == 'both':
+        columns = columns + ['mean_' + column for column in columns]
+
+    if early_stopping:
+        columns = columns + ['n_folds']
     
     for i in range(0, len(columns)):
         
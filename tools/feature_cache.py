@@ -0,0 +1,307 @@
+"""
+
+    The feature_cache Python module keeps an on-disk cache of the
+    feature matrix returned by featureFormat.
+
+    Loading final_project_dataset.pkl, parsing it with dict_parser
+    and formatting it with featureFormat gives the same array every
+    time the inputs are unchanged. The matrix is therefore saved as
+    a .npy file, named after a hash of:
+
+        - the content of the source pickle;
+        - the source code of the modules building the matrix
+          (dict_parser, variable_adder, dataset_store and
+          feature_format), so that a change to them is never
+          served stale features;
+        - the outliers list;
+        - the adder dictionary and the log_sqrt list;
+        - the features list and the featureFormat options.
+
+    Cached files are opened with mmap_mode, so that repeated runs
+    and parallel workers share one page-cached copy of the matrix.
+
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+
+import dict_parser
+import variable_adder
+import dataset_store
+import feature_format
+from feature_format import featureFormat, targetFeatureSplit
+
+# Bump this when the way the cache is keyed or saved changes, so
+# that old cache files are not reused (changes to the code of
+# CODE_MODULES are part of the key already)
+CACHE_VERSION = 2
+
+# Modules whose source code is part of the cache key
+CODE_MODULES = [dict_parser, variable_adder, dataset_store, feature_format]
+
+# Digest of the source code of CODE_MODULES, computed once
+_CODE_DIGEST = []
+
+###############################################################
+
+### CACHE KEY ###
+
+def file_digest(path, block_size = 2 ** 20):
+
+    """
+
+        This function returns the sha1 hex digest of the content
+        of a file.
+
+        Args:
+            - path: a string, i.e. the path of the file
+            - block_size: an integer, i.e. the bytes read at a time
+
+        Returns:
+            - digest: a string
+
+    """
+
+    sha = hashlib.sha1()
+
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(block_size), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def code_digest():
+
+    """
+
+        This function returns the sha1 hex digest of the source
+        code of CODE_MODULES (read once per process).
+
+    """
+
+    if not _CODE_DIGEST:
+
+        sha = hashlib.sha1()
+
+        for module in CODE_MODULES:
+            # The .py file of a module imported from a .pyc
+            path = os.path.splitext(module.__file__)[0] + '.py'
+            sha.update(file_digest(path).encode('ascii'))
+
+        _CODE_DIGEST.append(sha.hexdigest())
+
+    return _CODE_DIGEST[0]
+
+
+def cache_key(source_path,
+              features_list,
+              outliers = None,
+              adder_dictionary = None,
+              log_sqrt = None,
+              **format_options):
+
+    """
+
+        This function returns the key identifying a feature matrix
+        in the cache.
+
+        Args:
+            - source_path: a string, i.e. the path of the pickled
+                           data dictionary
+            - features_list: a Python list
+            - outliers: a Python list. By default it is set to None
+            - adder_dictionary: a Python dictionary. By default it
+                                is set to None
+            - log_sqrt: a Python list. By default it is set to None
+            - format_options: keyword arguments of featureFormat
+
+        Returns:
+            - key: a string
+
+    """
+
+    parameters = json.dumps({'version': CACHE_VERSION,
+                             'features_list': list(features_list),
+                             'outliers': sorted(outliers or []),
+                             'adder_dictionary': adder_dictionary,
+                             'log_sqrt': log_sqrt,
+                             'format_options': format_options},
+                            sort_keys = True)
+
+    sha = hashlib.sha1(file_digest(source_path).encode('ascii'))
+    sha.update(code_digest().encode('ascii'))
+    sha.update(parameters.encode('utf-8'))
+
+    return sha.hexdigest()
+
+###############################################################
+
+### CACHED FEATURE FORMAT ###
+
+def build_data(source_path,
+               features_list,
+               outliers = None,
+               adder_dictionary = None,
+               log_sqrt = None,
+               dataset = None,
+               **format_options):
+
+    """
+
+        This function builds the feature matrix without the cache,
+        i.e. it loads the source pickle, parses it (if outliers or
+        an adder dictionary are given) and runs featureFormat.
+
+        Args: as in load_features.
+
+        Returns:
+            - data: a numpy array
+
+        Raises ValueError if featureFormat does not return an
+        array (e.g. a feature of features_list is not present).
+
+    """
+
+    if dataset is None:
+
+        with open(source_path, 'rb') as data_file:
+            dataset = pickle.load(data_file)
+
+        if outliers or adder_dictionary or log_sqrt:
+            dataset = dict_parser.parse(dataset,
+                                        outliers or [],
+                                        adder_dictionary or {},
+                                        log_sqrt,
+                                        output = 'columnar',
+                                        features_list = features_list)
+
+    data = featureFormat(dataset, features_list, **format_options)
+
+    if not isinstance(data, np.ndarray):
+        raise ValueError('featureFormat did not return a matrix for '
+                         '%s: nothing is cached' % features_list)
+
+    return data
+
+
+def load_data(source_path,
+              features_list,
+              outliers = None,
+              adder_dictionary = None,
+              log_sqrt = None,
+              cache_dir = None,
+              mmap_mode = 'r',
+              dataset = None,
+              **format_options):
+
+    """
+
+        This function returns the featureFormat matrix for a pickled
+        data dictionary, building and saving it to the cache only if
+        it is not there yet.
+
+        Args: as in load_features.
+
+        Returns:
+            - data: a numpy array (a read-only memory map by default)
+
+    """
+
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(source_path), 'cache')
+
+    key = cache_key(source_path,
+                    features_list,
+                    outliers,
+                    adder_dictionary,
+                    log_sqrt,
+                    **format_options)
+
+    path = os.path.join(cache_dir, key + '.npy')
+
+    if not os.path.exists(path):
+
+        data = build_data(source_path,
+                          features_list,
+                          outliers,
+                          adder_dictionary,
+                          log_sqrt,
+                          dataset,
+                          **format_options)
+
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                # Another worker created it in the meantime
+                pass
+
+        # Write to a temporary file first, so that a parallel
+        # worker never opens a half-written matrix
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as tmp_file:
+            np.save(tmp_file, data)
+        os.rename(tmp_path, path)
+
+    return np.load(path, mmap_mode = mmap_mode)
+
+
+def load_features(source_path,
+                  features_list,
+                  outliers = None,
+                  adder_dictionary = None,
+                  log_sqrt = None,
+                  cache_dir = None,
+                  mmap_mode = 'r',
+                  dataset = None,
+                  **format_options):
+
+    """
+
+        This function returns labels and features for a pickled
+        data dictionary, using the on-disk cache.
+
+        Args:
+            - source_path: a string, i.e. the path of the pickled
+                           data dictionary
+            - features_list: a Python list, 'poi' first
+            - outliers: a Python list of names to be removed
+            - adder_dictionary: a Python dictionary (see
+                                variable_adder)
+            - log_sqrt: a Python list (see variable_adder)
+            - cache_dir: a string. By default it is the cache folder
+                         next to the source pickle
+            - mmap_mode: the mmap_mode used by np.load. Set it to
+                         None to load the matrix in memory
+            - dataset: the source pickle already parsed with these
+                       outliers, adder_dictionary and log_sqrt
+                       (e.g. by dict_parser.parse). If given, it is
+                       formatted on a cache miss instead of loading
+                       and parsing the source again. It is trusted:
+                       nothing checks that it matches the cache key,
+                       so a mismatched dataset is saved under that
+                       key and served until the source or the
+                       parsing code changes
+            - format_options: keyword arguments of featureFormat
+
+        Returns:
+            - labels, features: numpy arrays, i.e. the first column
+                                and the other columns of the matrix
+
+    """
+
+    data = load_data(source_path,
+                     features_list,
+                     outliers,
+                     adder_dictionary,
+                     log_sqrt,
+                     cache_dir,
+                     mmap_mode,
+                     dataset,
+                     **format_options)
+
+    return targetFeatureSplit(data, as_arrays = True)
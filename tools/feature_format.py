@@ -32,8 +32,9 @@
 
 
 import numpy as np
+from dataset_store import ColumnarDataset
 
-def featureFormat( dictionary, features, remove_NaN=True, remove_all_zeroes=True, remove_any_zeroes=False, sort_keys = False):
+def featureFormat( dictionary, features, remove_NaN=True, remove_all_zeroes=True, remove_any_zeroes=False, sort_keys = False, return_keys = False):
     """ convert dictionary to numpy array of features
         remove_NaN = True will convert "NaN" string to 0.0
         remove_all_zeroes = True will omit any data points for which
@@ -44,12 +45,74 @@ def featureFormat( dictionary, features, remove_NaN=True, remove_all_zeroes=True
             a string opens the corresponding pickle file with a preset key
             order (this is used for Python 3 compatibility, and sort_keys
             should be left as False for the course mini-projects).
+        return_keys = True also returns the list of keys of the data
+            points kept, in the same order as the rows of the array.
+        dictionary can also be a ColumnarDataset (see dataset_store), in
+            which case the columns are sliced from its matrix directly.
         NOTE: first feature is assumed to be 'poi' and is not checked for
             removal for zero or missing values.
     """
 
 
-    return_list = []
+    keys = _ordered_keys(dictionary, sort_keys)
+
+    ### extract every feature as a whole column, then filter the
+    ### rows with boolean masks instead of checking each data point
+    matrix = _format_matrix(dictionary, keys, features, remove_NaN)
+    if matrix is None:
+        return
+
+    keep = _row_mask(matrix, features, remove_all_zeroes, remove_any_zeroes)
+    if not keep.any():
+        data = np.array([])
+    else:
+        data = matrix[keep]
+
+    if return_keys:
+        return data, [key for key, kept in zip(keys, keep) if kept]
+
+    return data
+
+
+class FeatureUniverse(object):
+    """ format a dictionary once for a whole universe of candidate
+        features, then return any features list as a projection
+
+        universe = FeatureUniverse(data_dictionary, all_features,
+                                   sort_keys = True)
+        data_array = universe.project(["poi", "salary", "bonus"])
+
+        project gives the same array as featureFormat with the same
+        arguments: the columns are sliced from the formatted matrix and
+        remove_all_zeroes / remove_any_zeroes are recomputed on the
+        projected columns only.
+    """
+
+    def __init__( self, dictionary, features, remove_NaN=True, sort_keys = False ):
+        self.features = list(features)
+        self.keys = _ordered_keys(dictionary, sort_keys)
+        self.matrix = _format_matrix(dictionary, self.keys, self.features, remove_NaN)
+        if self.matrix is None:
+            raise KeyError("features not present in dictionary")
+        self._columns = dict((feature, j) for j, feature in enumerate(self.features))
+
+    def project( self, features, remove_all_zeroes=True, remove_any_zeroes=False ):
+        for feature in features:
+            if feature not in self._columns:
+                print "error: key ", feature, " not present"
+                return
+
+        matrix = self.matrix[:, [self._columns[feature] for feature in features]]
+
+        keep = _row_mask(matrix, features, remove_all_zeroes, remove_any_zeroes)
+        if not keep.any():
+            return np.array([])
+
+        return matrix[keep]
+
+
+def _ordered_keys(dictionary, sort_keys):
+    """ keys of dictionary in the order selected by sort_keys """
 
     # Key order - first branch is for Python 3 compatibility on mini-projects,
     # second branch is for compatibility on final project.
@@ -61,48 +124,76 @@ def featureFormat( dictionary, features, remove_NaN=True, remove_all_zeroes=True
     else:
         keys = dictionary.keys()
 
-    for key in keys:
-        tmp_list = []
-        for feature in features:
-            try:
-                dictionary[key][feature]
-            except KeyError:
-                print "error: key ", feature, " not present"
-                return
-            value = dictionary[key][feature]
-            if value=="NaN" and remove_NaN:
-                value = 0
-            tmp_list.append( float(value) )
-
-        # Logic for deciding whether or not to add the data point.
-        append = True
-        # exclude 'poi' class as criteria.
-        if features[0] == 'poi':
-            test_list = tmp_list[1:]
-        else:
-            test_list = tmp_list
-        ### if all features are zero and you want to remove
-        ### data points that are all zero, do that here
-        if remove_all_zeroes:
-            append = False
-            for item in test_list:
-                if item != 0 and item != "NaN":
-                    append = True
-                    break
-        ### if any features for a given data point are zero
-        ### and you want to remove data points with any zeroes,
-        ### handle that here
-        if remove_any_zeroes:
-            if 0 in test_list or "NaN" in test_list:
-                append = False
-        ### Append the data point if flagged for addition.
-        if append:
-            return_list.append( np.array(tmp_list) )
-
-    return np.array(return_list)
-
-
-def targetFeatureSplit( data ):
+    return list(keys)
+
+
+def _format_matrix(dictionary, keys, features, remove_NaN):
+    """ the (n x k) float matrix of features, before row filtering """
+
+    if isinstance(dictionary, ColumnarDataset):
+        try:
+            return dictionary.feature_matrix(keys, features, remove_NaN)
+        except KeyError:
+            ### fall through to print the missing feature
+            pass
+
+    return _extract_columns(dictionary, keys, features, remove_NaN)
+
+
+def _extract_columns(dictionary, keys, features, remove_NaN):
+    """ build the (n x k) float matrix column by column, in the order
+        given by keys. Returns None (after printing the same error
+        message as the row-by-row version) if a feature is missing.
+    """
+
+    try:
+        records = [dictionary[key] for key in keys]
+        matrix = np.empty((len(records), len(features)))
+        for j, feature in enumerate(features):
+            column = [record[feature] for record in records]
+            if remove_NaN:
+                column = [0 if value == "NaN" else value for value in column]
+            matrix[:, j] = np.array(column, dtype=float)
+    except KeyError:
+        ### report the first missing feature in row-major order
+        for key in keys:
+            for feature in features:
+                try:
+                    dictionary[key][feature]
+                except KeyError:
+                    print "error: key ", feature, " not present"
+                    return
+        raise
+
+    return matrix
+
+
+def _row_mask(matrix, features, remove_all_zeroes, remove_any_zeroes):
+    """ boolean mask of the rows of matrix to keep, following the
+        remove_all_zeroes / remove_any_zeroes rules of featureFormat
+    """
+
+    # exclude 'poi' class as criteria.
+    if features[0] == 'poi':
+        test_matrix = matrix[:, 1:]
+    else:
+        test_matrix = matrix
+
+    keep = np.ones(len(matrix), dtype=bool)
+    ### if all features are zero and you want to remove
+    ### data points that are all zero, do that here
+    if remove_all_zeroes:
+        keep &= (test_matrix != 0).any(axis=1)
+    ### if any features for a given data point are zero
+    ### and you want to remove data points with any zeroes,
+    ### handle that here
+    if remove_any_zeroes:
+        keep &= ~(test_matrix == 0).any(axis=1)
+
+    return keep
+
+
+def targetFeatureSplit( data, as_arrays=False ):
     """ 
         given a numpy array like the one returned from
         featureFormat, separate out the first feature
@@ -111,10 +202,24 @@ def targetFeatureSplit( data ):
 
         return targets and features as separate lists
 
+        as_arrays = True returns data[:, 0] and data[:, 1:] instead,
+            i.e. numpy views on data with no per-row Python objects
+            (copy them with np.ascontiguousarray if data is reused).
+            If featureFormat kept no row (data is np.array([])),
+            they are np.empty(0) and np.empty((0, 0))
+
         (sklearn can generally handle both lists and numpy arrays as 
         input formats when training/predicting)
     """
 
+    if as_arrays:
+        data = np.asarray(data)
+        # featureFormat returns a 1-D empty array when every row
+        # is filtered out, as the list mode returns ([], [])
+        if data.ndim == 1 and not len(data):
+            return np.empty(0), np.empty((0, 0))
+        return data[:, 0], data[:, 1:]
+
     target = []
     features = []
     for item in data:
@@ -122,7 +227,3 @@ def targetFeatureSplit( data ):
         features.append( item[1:] )
 
     return target, features
-
-
-
-
@@ -0,0 +1,272 @@
+"""
+
+    The feature_pipeline Python module keeps a parsed and formatted
+    Enron dataset up to date when records are added or changed.
+
+    dict_parser.parse and featureFormat work on the whole
+    population. Every step they run (conversion, outlier removal
+    by name, variable_adder features, NaN handling and row
+    filtering) is row-local, though, so a FeaturePipeline only
+    runs them on the new or changed records and merges the result
+    into the dataset and the formatted matrix it already holds:
+
+        pipeline = FeaturePipeline(outliers,
+                                   adder_dictionary,
+                                   log_sqrt,
+                                   features_list,
+                                   sort_keys = True)
+        pipeline.fit(data_dict)
+        pipeline.upsert(new_records)
+        labels, features = pipeline.labels_features()
+
+    After an upsert, dataset and data are the same as parsing and
+    formatting the whole updated population from scratch.
+
+"""
+
+import numpy as np
+
+import dict_parser
+import variable_adder
+from dataset_store import ColumnarDataset
+from feature_format import featureFormat, targetFeatureSplit
+
+###############################################################
+
+### FEATURE PIPELINE ###
+
+class FeaturePipeline(object):
+
+    """
+
+        A parsed dataset and its featureFormat matrix, updated
+        incrementally.
+
+        Args:
+            - outliers: a Python list
+            - adder_dictionary: a Python dictionary
+            - log_sqrt: a Python list. By default it is set to None
+            - features_list: a Python list, 'poi' first. It is
+                             required (ValueError if None or empty)
+            - remove_NaN, remove_all_zeroes, remove_any_zeroes,
+              sort_keys: as in featureFormat. sort_keys must be a
+              boolean (a pickled key order cannot include new names)
+
+        Attributes:
+            - dataset: a ColumnarDataset, i.e. the parsed dataset
+            - data: a numpy array, i.e. the featureFormat matrix
+            - names: a Python list, i.e. the name of every row of data
+
+    """
+
+    def __init__(self,
+                 outliers,
+                 adder_dictionary,
+                 log_sqrt = None,
+                 features_list = None,
+                 remove_NaN = True,
+                 remove_all_zeroes = True,
+                 remove_any_zeroes = False,
+                 sort_keys = False):
+
+        if not isinstance(sort_keys, bool):
+            raise ValueError('sort_keys must be True or False')
+
+        # featureFormat needs the features to format, 'poi' first
+        if not features_list:
+            raise ValueError('features_list must name at least one '
+                             'feature')
+
+        self.outliers = list(outliers)
+        self.features_list = list(features_list)
+        self.format_options = {'remove_NaN': remove_NaN,
+                               'remove_all_zeroes': remove_all_zeroes,
+                               'remove_any_zeroes': remove_any_zeroes,
+                               'sort_keys': sort_keys}
+
+        # Only the variables features_list needs are derived
+        self.plan = variable_adder.compile_plan(adder_dictionary,
+                                                log_sqrt,
+                                                self.features_list)
+
+        if not variable_adder.is_row_local(self.plan):
+            raise ValueError('Transforms that are not row-local (e.g. '
+                             'rank) cannot be updated incrementally')
+
+        self.fields = None
+        self.dataset = None
+        self._reset()
+
+    def _parse(self, data_dict):
+
+        """ Parse records into a ColumnarDataset. """
+
+        if self.fields is None:
+            self.fields = dict_parser.extract_fields_from_dict(data_dict)
+
+        dataframe = dict_parser.convert_into_df(data_dict, self.fields)
+        dataframe = dict_parser.remove_outliers(dataframe, self.outliers)
+        dataframe = variable_adder.execute_plan(dataframe, self.plan)
+
+        return ColumnarDataset.from_dataframe(dataframe)
+
+    def _format(self, dataset):
+
+        """ The featureFormat matrix and kept names of a dataset. """
+
+        data, names = featureFormat(dataset,
+                                    self.features_list,
+                                    return_keys = True,
+                                    **self.format_options)
+
+        if not len(names):
+            data = np.empty((0, len(self.features_list)))
+
+        return data, names
+
+    def _reset(self):
+
+        """ Empty the buffers, the row order, data and names. """
+
+        # The featureFormat row of every dataset row (if it is
+        # kept), in buffers grown as the dataset
+        self._values = np.empty((0, len(self.features_list)))
+        self._kept = np.zeros(0, dtype=bool)
+
+        # The dataset rows in the order of featureFormat (sorted by
+        # name with sort_keys), and their names
+        self._order = np.zeros(0, dtype=np.intp)
+        self._order_names = np.array([], dtype=object)
+
+        self.data = np.empty((0, len(self.features_list)))
+        self.names = []
+
+    def _insert(self, new_names):
+
+        """
+
+            This function inserts the rows of new dataset names in
+            the row order: at their sorted positions with sort_keys,
+            at the end (in dataset order) otherwise.
+
+        """
+
+        if not new_names:
+            return
+
+        if self.format_options['sort_keys']:
+            new_names = sorted(new_names)
+            positions = np.searchsorted(self._order_names, new_names)
+        else:
+            new_names = sorted(new_names, key = self.dataset.row)
+            positions = len(self._order)
+
+        rows = [self.dataset.row(name) for name in new_names]
+
+        # object arrays, so that names are not turned into fixed
+        # width strings
+        names = np.empty(len(new_names), dtype=object)
+        names[:] = new_names
+
+        self._order = np.insert(self._order, positions, rows)
+        self._order_names = np.insert(self._order_names, positions, names)
+
+    def _store(self, update, data, names):
+
+        """
+
+            This function writes the formatted rows of an update at
+            the dataset rows of its names, marks the names it did
+            not keep, and gathers data and names again.
+
+        """
+
+        n_rows = len(self.dataset)
+
+        # Buffers grow as ColumnarDataset's, doubling their size
+        if len(self._kept) < n_rows:
+            capacity = max(n_rows, 2 * len(self._kept))
+            values = np.empty((capacity, len(self.features_list)))
+            values[:len(self._values)] = self._values
+            kept = np.zeros(capacity, dtype=bool)
+            kept[:len(self._kept)] = self._kept
+            self._values, self._kept = values, kept
+
+        rows = np.array([self.dataset.row(name) for name in update],
+                        dtype=int)
+        self._kept[rows] = False
+
+        rows = np.array([self.dataset.row(name) for name in names],
+                        dtype=int)
+        self._values[rows] = data
+        self._kept[rows] = True
+
+        # The kept rows, in order (numpy copies, no Python loop)
+        kept = self._kept[self._order]
+        self.data = self._values[self._order[kept]]
+        self.names = self._order_names[kept].tolist()
+
+    def fit(self, data_dict):
+
+        """
+
+            This function parses and formats a whole population.
+
+            Args:
+                - data_dict: a Python dictionary formatted as the
+                             Enron one
+
+            Returns:
+                - self
+
+        """
+
+        self.dataset = self._parse(data_dict)
+        self._reset()
+
+        self._insert(list(self.dataset))
+        self._store(self.dataset, *self._format(self.dataset))
+
+        return self
+
+    def upsert(self, data_dict):
+
+        """
+
+            This function adds new records, or replaces records with
+            the same name, parsing and formatting only those. The
+            dataset is updated in place, and the rows of the update
+            are written over their previous rows or appended. New
+            rows are inserted in the row order with searchsorted.
+            Python work is proportional to the size of the update;
+            data and names are then gathered again by numpy, a copy
+            of the kept rows.
+
+            Args:
+                - data_dict: a Python dictionary formatted as the
+                             Enron one, with the new or changed
+                             records only
+
+            Returns:
+                - self
+
+        """
+
+        if self.dataset is None:
+            return self.fit(data_dict)
+
+        update = self._parse(data_dict)
+
+        new_names = [name for name in update if name not in self.dataset]
+        self.dataset.upsert(update)
+
+        self._insert(new_names)
+        self._store(update, *self._format(update))
+
+        return self
+
+    def labels_features(self):
+
+        """ Labels and features of data, as numpy arrays. """
+
+        return targetFeatureSplit(self.data, as_arrays = True)
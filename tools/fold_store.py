@@ -0,0 +1,419 @@
+"""
+
+    The fold_store Python module keeps what a classifier predicted
+    on every fold of an evaluation, so that it can be scored again
+    (with another metric, decision threshold or aggregation)
+    without fitting it again:
+
+        store = collect_folds(clf, features, labels)
+        store.save('lr_folds.npz')
+
+        store = FoldStore.load('lr_folds.npz')
+        store.scores()                       # as tester.py
+        store.scores(how = 'mean')           # as evaluate.eval_clf
+        store.scores(threshold = 0.3)
+        store.roc_auc()
+        precision, recall, thresholds = store.pr_curve()
+        store.best_threshold('f1', min_precision = 0.3,
+                             min_recall = 0.3)
+
+    For every fold, the store holds the test indices (int32), the
+    test labels and hard predictions (int8) and the probabilities
+    of the positive class (float32, NaN if the classifier has no
+    predict_proba).
+
+"""
+
+import numpy as np
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.metrics import roc_auc_score, roc_curve, \
+                            precision_recall_curve
+
+import cv_engine
+import variable_adder
+
+###############################################################
+
+### COLLECT ###
+
+def _predict_fold(clf, features_train, labels_train,
+                  features_test, labels_test):
+
+    """
+
+        This fold function fits a classifier and returns its
+        predictions and positive-class probabilities.
+
+    """
+
+    clf.fit(features_train, labels_train)
+    predictions = clf.predict(features_test)
+
+    if hasattr(clf, 'predict_proba'):
+        positive = list(clf.classes_).index(1)
+        probabilities = clf.predict_proba(features_test)[:, positive]
+    else:
+        probabilities = np.full(len(labels_test), np.nan)
+
+    return (np.asarray(predictions).astype(np.int8),
+            np.asarray(probabilities).astype(np.float32))
+
+
+def collect_folds(clf,
+                  features,
+                  labels,
+                  folds = 1000,
+                  random_state = 42,
+                  prescale = False,
+                  n_jobs = 1):
+
+    """
+
+        This function fits a classifier once on every fold and
+        returns a FoldStore of its predictions.
+
+        Args: as in cv_engine.evaluate_folds.
+
+        Returns:
+            - store: a FoldStore
+
+    """
+
+    features = np.asarray(features)
+    labels = np.asarray(labels)
+
+    if prescale:
+        features = MinMaxScaler().fit_transform(features)
+
+    if isinstance(folds, int):
+        folds = cv_engine.make_folds(labels, folds, random_state)
+
+    results = cv_engine.run_folds(clf,
+                                  features,
+                                  labels,
+                                  folds,
+                                  _predict_fold,
+                                  n_jobs = n_jobs)
+
+    test_idx = np.array([test for _, test in folds], dtype = np.int32)
+
+    return FoldStore(test_idx,
+                     labels[test_idx],
+                     np.array([result[0] for result in results]),
+                     np.array([result[1] for result in results]))
+
+###############################################################
+
+### FOLD STORE ###
+
+class FoldStore(object):
+
+    """
+
+        The test indices, labels, predictions and probabilities of
+        every fold of an evaluation.
+
+        Args:
+            - test_idx: an int32 numpy array, one row per fold
+            - labels: the labels of test_idx (stored as int8)
+            - predictions: the hard predictions (stored as int8)
+            - probabilities: the probabilities of the positive
+                             class (stored as float32)
+
+    """
+
+    def __init__(self, test_idx, labels, predictions, probabilities):
+
+        self.test_idx = np.asarray(test_idx, dtype = np.int32)
+        self.labels = np.asarray(labels).astype(np.int8)
+        self.predictions = np.asarray(predictions).astype(np.int8)
+        self.probabilities = np.asarray(probabilities).astype(np.float32)
+
+    def __len__(self):
+
+        return len(self.test_idx)
+
+    def save(self, path):
+
+        """ Save the store as a .npz file. """
+
+        np.savez(path,
+                 test_idx = self.test_idx,
+                 labels = self.labels,
+                 predictions = self.predictions,
+                 probabilities = self.probabilities)
+
+    @classmethod
+    def load(cls, path):
+
+        """ Load a store saved with save. """
+
+        with np.load(path) as store_file:
+            return cls(store_file['test_idx'],
+                       store_file['labels'],
+                       store_file['predictions'],
+                       store_file['probabilities'])
+
+    ### RE-SCORING ###
+
+    def _check_probabilities(self):
+
+        """
+
+            Raise a ValueError if some probabilities are NaN, i.e.
+            the classifier had no predict_proba.
+
+        """
+
+        if np.isnan(self.probabilities).any():
+            raise ValueError('The store has no probabilities (the '
+                             'classifier has no predict_proba): only '
+                             'its predictions can be scored')
+
+    def predict(self, threshold = None):
+
+        """
+
+            The predictions of every fold: the stored ones, or
+            probabilities >= threshold if a threshold is given
+            (ValueError if the probabilities are not known).
+
+        """
+
+        if threshold is None:
+            return self.predictions
+
+        self._check_probabilities()
+
+        return (self.probabilities >= threshold).astype(np.int8)
+
+    def counts(self, threshold = None, stop_at_invalid = False):
+
+        """
+
+            This function returns the confusion counts of every
+            fold, i.e. an array with one row of tn, fp, fn and tp
+            per fold, and whether every label and prediction of
+            the fold was 0 or 1 (see
+            cv_engine.batched_confusion_counts).
+
+        """
+
+        return cv_engine.batched_confusion_counts(self.labels,
+                                                  self.predict(threshold),
+                                                  stop_at_invalid)
+
+    def records(self, threshold = None, stop_at_invalid = False):
+
+        """
+
+            This function returns the fold records of the stored
+            predictions (see cv_engine.evaluate_folds).
+
+        """
+
+        counts, valid = self.counts(threshold, stop_at_invalid)
+
+        return cv_engine.fold_records(counts, valid)
+
+    def scores(self, threshold = None, how = 'pooled'):
+
+        """
+
+            This function scores the stored predictions.
+
+            Args:
+                - threshold: a float or None (see predict)
+                - how: a string, 'pooled' (scores of the counts
+                       summed over the folds, as tester.py) or
+                       'mean' (per-fold scores averaged, as
+                       evaluate.eval_clf)
+
+            Returns:
+                - scores: a Python dictionary with accuracy,
+                          precision, recall, f1 and f2
+
+        """
+
+        records = self.records(threshold)
+        names = ['accuracy', 'precision', 'recall', 'f1', 'f2']
+
+        if how == 'pooled':
+            values = cv_engine.pooled_scores(records)
+            precision, recall = values[1:3]
+            values.append(cv_engine.divide_or_zero(
+                [5 * precision * recall], [4 * precision + recall])[0])
+        elif how == 'mean':
+            values = cv_engine.mean_scores(records, names)
+        else:
+            raise ValueError('Unknown aggregation: %s' % how)
+
+        return dict(zip(names, values))
+
+    def roc_auc(self, how = 'pooled'):
+
+        """
+
+            This function returns the ROC AUC of the probabilities,
+            either on all the folds pooled together or averaged
+            over the folds ('mean').
+
+        """
+
+        self._check_probabilities()
+
+        if how == 'pooled':
+            return roc_auc_score(self.labels.ravel(),
+                                 self.probabilities.ravel())
+
+        if how != 'mean':
+            raise ValueError('Unknown aggregation: %s' % how)
+
+        # Mann-Whitney statistic of every fold at once: the rank
+        # sum of the positives, ties taking their average rank.
+        # Labels other than 0 and 1 are ranked last, so that they
+        # do not change the ranks of the others
+        positive = (self.labels == 1)
+        negative = (self.labels == 0)
+        probabilities = np.where(positive | negative,
+                                 self.probabilities.astype(float),
+                                 np.inf)
+
+        ranks = variable_adder.average_ranks(probabilities)
+
+        n_positive = positive.sum(axis = 1).astype(float)
+        n_negative = negative.sum(axis = 1).astype(float)
+
+        auc = ((ranks * positive).sum(axis = 1)
+               - n_positive * (n_positive + 1) / 2.) \
+              / (n_positive * n_negative)
+
+        return auc.mean()
+
+    def threshold_sweep(self):
+
+        """
+
+            This function scores every distinct decision threshold
+            of the pooled probabilities, i.e. predicting 1 when
+            probability >= threshold, as scores(threshold) would.
+            Probabilities are sorted once and the confusion counts
+            of all the thresholds come from cumulative sums.
+
+            Returns:
+                - sweep: a Python dictionary of numpy arrays, one
+                         value per threshold (from the highest):
+                         threshold, tn, fp, fn, tp, accuracy,
+                         precision, recall, f1 and f2 (pooled, as
+                         in tester.py)
+
+        """
+
+        self._check_probabilities()
+
+        labels = self.labels.ravel()
+        probabilities = self.probabilities.ravel()
+
+        # Only the folds' valid 0/1 labels
+        known = (labels == 0) | (labels == 1)
+        labels = labels[known].astype(np.int64)
+        probabilities = probabilities[known]
+
+        if not len(labels):
+            raise ValueError('The store has no known probability of '
+                             'a 0/1 label to sweep')
+
+        order = np.argsort(-probabilities, kind = 'mergesort')
+        probabilities = probabilities[order]
+        labels = labels[order]
+
+        # Predicted positives for a threshold are all the
+        # probabilities down to the last one equal to it
+        last = np.r_[np.flatnonzero(np.diff(probabilities)),
+                     len(probabilities) - 1]
+
+        tp = np.cumsum(labels)[last]
+        fp = (last + 1) - tp
+        fn = labels.sum() - tp
+        tn = (len(labels) - labels.sum()) - fp
+
+        sweep = {'threshold': probabilities[last],
+                 'tn': tn, 'fp': fp, 'fn': fn, 'tp': tp}
+
+        precision = tp / (tp + fp).astype(float)
+        recall = cv_engine.divide_or_zero(tp, tp + fn)
+
+        sweep['accuracy'] = (tp + tn) / float(len(labels))
+        sweep['precision'] = precision
+        sweep['recall'] = recall
+        sweep['f1'] = cv_engine.divide_or_zero(2 * tp, 2 * tp + fp + fn)
+        sweep['f2'] = cv_engine.divide_or_zero(5 * precision * recall,
+                                               4 * precision + recall)
+
+        return sweep
+
+    def best_threshold(self,
+                       metric = 'f1',
+                       min_precision = None,
+                       min_recall = None,
+                       sweep = None):
+
+        """
+
+            This function returns the operating point of
+            threshold_sweep with the highest metric, among those
+            meeting the minimum precision and recall if given.
+
+            Args:
+                - metric: a string, i.e. a score of threshold_sweep
+                - min_precision, min_recall: floats or None, e.g.
+                                             0.3 as in the project
+                - sweep: the result of threshold_sweep, if already
+                         computed
+
+            Returns:
+                - point: a Python dictionary with the threshold and
+                         its scores, or None if no threshold meets
+                         the minimums
+
+        """
+
+        if sweep is None:
+            sweep = self.threshold_sweep()
+
+        if metric not in sweep or metric == 'threshold':
+            raise ValueError('Unknown metric: %s' % metric)
+
+        allowed = np.ones(len(sweep['threshold']), dtype = bool)
+        if min_precision is not None:
+            allowed &= sweep['precision'] >= min_precision
+        if min_recall is not None:
+            allowed &= sweep['recall'] >= min_recall
+
+        if not allowed.any():
+            return None
+
+        # The first, i.e. highest, threshold among the best ones
+        best = np.flatnonzero(allowed)[np.argmax(sweep[metric][allowed])]
+
+        return dict((name, values[best].item())
+                    for name, values in sweep.items())
+
+    def roc_curve(self):
+
+        """ The ROC curve of the pooled probabilities. """
+
+        return roc_curve(self.labels.ravel(), self.probabilities.ravel())
+
+    def pr_curve(self):
+
+        """
+
+            The precision-recall curve of the pooled probabilities,
+            i.e. precision, recall and thresholds as returned by
+            sklearn.metrics.precision_recall_curve.
+
+        """
+
+        return precision_recall_curve(self.labels.ravel(),
+                                      self.probabilities.ravel())
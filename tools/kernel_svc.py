@@ -0,0 +1,332 @@
+"""
+
+    The kernel_svc Python module fits SVCs on precomputed kernel
+    matrices, so that the kernel of a dataset is computed once per
+    (kernel, gamma) instead of once per fold and value of C.
+
+    The features of a dataset are registered under a key. The
+    classifiers then take row indices instead of features:
+
+        key, rows = prepare(features)
+        clf = PrecomputedSVC(data = key, kernel = 'rbf', C = 10)
+        clf.fit(rows[train_idx], labels[train_idx])
+        clf.predict(rows[test_idx])
+
+    By default the features are scaled with MinMaxScaler once, on
+    the whole dataset (as in modified_tester.py): a fit slices the
+    train x train block of the Gram matrix of the whole dataset,
+    and a prediction the test x train block. As rows are ordinary
+    features, a PrecomputedSVC can be used wherever an SVC can,
+    e.g. in GridSearchCV or cv_engine.evaluate_folds:
+
+        evaluate.eval_clf(from_svc(best_clf, key), rows, labels)
+
+    With fold_scaling, the features are registered unscaled and
+    every training fold is scaled on its own rows, as by the
+    MinMaxScaler and SVC pipeline of clf_builder.pipe_builder:
+
+        key, rows = prepare(features, prescale = False)
+        clf = from_svc(svc, key, fold_scaling = True)
+
+    The kernel is then computed once per training fold (all rows x
+    training rows) instead of once per dataset, and still reused
+    for every value of C.
+
+    Gram matrices are kept in a module-level cache, shared by all
+    the classifiers (and, once computed, by the forked workers of
+    cv_engine) until the dataset is released (release) or the
+    cache cleared (clear_cache).
+
+"""
+
+import hashlib
+
+import numpy as np
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.metrics.pairwise import pairwise_kernels
+from sklearn.pipeline import Pipeline, make_pipeline
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.svm import SVC
+
+# Scaled features, by key
+_DATA = {}
+
+# Gram matrices, by (key, kernel, gamma, degree, coef0), or by
+# (key, training fold, kernel, gamma, degree, coef0) with
+# fold_scaling
+_GRAMS = {}
+
+# SVC parameters shared with PrecomputedSVC
+SVC_PARAMS = ['C', 'kernel', 'degree', 'gamma', 'coef0', 'shrinking',
+              'probability', 'tol', 'cache_size', 'class_weight',
+              'max_iter', 'decision_function_shape', 'random_state']
+
+###############################################################
+
+### DATA AND GRAM MATRICES ###
+
+def prepare(features, prescale = True):
+
+    """
+
+        This function registers the features of a dataset and
+        returns its key and the row indices to use as features.
+
+        Args:
+            - features: array of features extracted from the dataset
+            - prescale: a boolean. If True, features are scaled with
+                        MinMaxScaler first
+
+        Returns:
+            - key: a string, i.e. the data parameter of
+                   PrecomputedSVC
+            - rows: a numpy array with one column, the index of
+                    every observation
+
+    """
+
+    features = np.asarray(features, dtype = float)
+
+    if prescale:
+        features = MinMaxScaler().fit_transform(features)
+
+    features = np.ascontiguousarray(features)
+    features.flags.writeable = False
+
+    sha = hashlib.sha1(features.tostring())
+    sha.update(str(features.shape).encode('utf-8'))
+    key = sha.hexdigest()
+
+    _DATA[key] = features
+
+    return key, np.arange(len(features)).reshape(-1, 1)
+
+
+def gram_matrix(key, kernel = 'rbf', gamma = 'auto', degree = 3,
+                coef0 = 0.0):
+
+    """
+
+        This function returns the kernel matrix of all the
+        observations of a registered dataset, as SVC defines its
+        kernels, computing it only if it is not in the cache.
+
+    """
+
+    features = _DATA[key]
+    params = _kernel_params(features, kernel, gamma, degree, coef0)
+
+    cache_key = (key, kernel) + tuple(sorted(params.items()))
+
+    if cache_key not in _GRAMS:
+        gram = pairwise_kernels(features, metric = kernel, **params)
+        gram.flags.writeable = False
+        _GRAMS[cache_key] = gram
+
+    return _GRAMS[cache_key]
+
+
+def fold_gram_matrix(key, train_rows, kernel = 'rbf', gamma = 'auto',
+                     degree = 3, coef0 = 0.0):
+
+    """
+
+        This function returns the kernel matrix of all the
+        observations of a registered dataset against its training
+        rows (in their order), the features being scaled with a
+        MinMaxScaler fitted on the training rows. It is computed
+        only if it is not in the cache.
+
+    """
+
+    features = _DATA[key]
+    params = _kernel_params(features, kernel, gamma, degree, coef0)
+
+    fold = hashlib.sha1(np.ascontiguousarray(train_rows,
+                                             dtype = np.intp).tostring())
+    cache_key = (key, fold.hexdigest(), kernel) \
+                + tuple(sorted(params.items()))
+
+    if cache_key not in _GRAMS:
+        scaled = MinMaxScaler().fit(features[train_rows]) \
+                               .transform(features)
+        gram = pairwise_kernels(scaled, scaled[train_rows],
+                                metric = kernel, **params)
+        gram.flags.writeable = False
+        _GRAMS[cache_key] = gram
+
+    return _GRAMS[cache_key]
+
+
+def _kernel_params(features, kernel, gamma, degree, coef0):
+
+    """ The parameters of pairwise_kernels, as SVC uses them. """
+
+    if gamma == 'auto':
+        gamma = 1.0 / features.shape[1]
+
+    # Parameters a kernel does not use do not split the cache
+    if kernel == 'linear':
+        return {}
+    if kernel == 'rbf':
+        return {'gamma': gamma}
+    if kernel == 'sigmoid':
+        return {'gamma': gamma, 'coef0': coef0}
+    if kernel == 'poly':
+        return {'gamma': gamma, 'coef0': coef0, 'degree': degree}
+
+    raise ValueError('Unknown kernel: %s' % kernel)
+
+
+def release(key):
+
+    """
+
+        This function drops a registered dataset and its Gram
+        matrices, e.g. once a search on it is over.
+
+    """
+
+    _DATA.pop(key, None)
+
+    for cache_key in [cache_key for cache_key in _GRAMS
+                      if cache_key[0] == key]:
+        del _GRAMS[cache_key]
+
+
+def clear_cache():
+
+    """ This function drops the registered data and Gram matrices. """
+
+    _DATA.clear()
+    _GRAMS.clear()
+
+###############################################################
+
+### CLASSIFIER ###
+
+class PrecomputedSVC(BaseEstimator, ClassifierMixin):
+
+    """
+
+        An SVC on the Gram matrix of a registered dataset. It takes
+        the parameters of SVC, data, the key of prepare, and
+        fold_scaling, a boolean (if True, features are scaled on
+        the training rows of every fit). X is a column of row
+        indices (see prepare).
+
+    """
+
+    def __init__(self,
+                 data = None,
+                 fold_scaling = False,
+                 C = 1.0,
+                 kernel = 'rbf',
+                 degree = 3,
+                 gamma = 'auto',
+                 coef0 = 0.0,
+                 shrinking = True,
+                 probability = False,
+                 tol = 1e-3,
+                 cache_size = 200,
+                 class_weight = None,
+                 max_iter = -1,
+                 decision_function_shape = 'ovr',
+                 random_state = None):
+
+        self.data = data
+        self.fold_scaling = fold_scaling
+        self.C = C
+        self.kernel = kernel
+        self.degree = degree
+        self.gamma = gamma
+        self.coef0 = coef0
+        self.shrinking = shrinking
+        self.probability = probability
+        self.tol = tol
+        self.cache_size = cache_size
+        self.class_weight = class_weight
+        self.max_iter = max_iter
+        self.decision_function_shape = decision_function_shape
+        self.random_state = random_state
+
+    def _block(self, X):
+
+        """ The X x train block of the Gram matrix. """
+
+        rows = np.asarray(X).ravel().astype(np.intp)
+
+        if self.fold_scaling:
+            return fold_gram_matrix(self.data, self.train_rows_,
+                                    self.kernel, self.gamma,
+                                    self.degree, self.coef0)[rows]
+
+        gram = gram_matrix(self.data, self.kernel, self.gamma,
+                           self.degree, self.coef0)
+
+        return gram[np.ix_(rows, self.train_rows_)]
+
+    def fit(self, X, y):
+
+        params = dict((name, getattr(self, name)) for name in SVC_PARAMS)
+        params['kernel'] = 'precomputed'
+
+        self.train_rows_ = np.asarray(X).ravel().astype(np.intp)
+        self.svc_ = SVC(**params).fit(self._block(X), y)
+        self.classes_ = self.svc_.classes_
+
+        return self
+
+    def predict(self, X):
+
+        return self.svc_.predict(self._block(X))
+
+    def predict_proba(self, X):
+
+        return self.svc_.predict_proba(self._block(X))
+
+    def decision_function(self, X):
+
+        return self.svc_.decision_function(self._block(X))
+
+###############################################################
+
+### CONVERSION ###
+
+def from_svc(clf, key, fold_scaling = False):
+
+    """
+
+        This function returns the PrecomputedSVC of an SVC, or of a
+        Pipeline of a MinMaxScaler and an SVC (the scaling being
+        the one of prepare, or of every training fold with
+        fold_scaling), on the data registered under key.
+
+    """
+
+    if isinstance(clf, Pipeline):
+        clf = clf.steps[-1][1]
+
+    params = clf.get_params(deep = False)
+
+    return PrecomputedSVC(data = key,
+                          fold_scaling = fold_scaling,
+                          **dict((name, params[name])
+                                 for name in SVC_PARAMS))
+
+
+def to_pipeline(clf):
+
+    """
+
+        This function returns the MinMaxScaler and SVC Pipeline
+        of clf_builder.pipe_builder with the parameters of a
+        PrecomputedSVC, i.e. a classifier taking features.
+
+    """
+
+    params = clf.get_params(deep = False)
+
+    return make_pipeline(MinMaxScaler(),
+                         SVC(**dict((name, params[name])
+                                    for name in SVC_PARAMS)))
@@ -6,12 +6,12 @@
     a list of scores.
 
 """
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.cross_validation import StratifiedShuffleSplit
+from cv_engine import evaluate_folds, pooled_scores
 
 def test_classifier(clf_best,
                     features,
-                    labels):
+                    labels,
+                    n_jobs = 1):
 
     """
 
@@ -23,48 +23,16 @@ def test_classifier(clf_best,
             - features, labels: array of features,
                                 labels extracted from
                                 the dataset.
+            - n_jobs: an integer, i.e. the number of processes
+                      the folds are run in (see cv_engine)
 
     """
     
-    cv = StratifiedShuffleSplit(labels, 1000, random_state=42)
-
-    scaler = MinMaxScaler()
-    features = scaler.fit_transform(features)
-
-    true_negatives = 0
-    false_negatives = 0
-    true_positives = 0
-    false_positives = 0
-    for train_idx, test_idx in cv: 
-        features_train = []
-        features_test  = []
-        labels_train   = []
-        labels_test    = []
-        for ii in train_idx:
-            features_train.append( features[ii] )
-            labels_train.append( labels[ii] )
-        for jj in test_idx:
-            features_test.append( features[jj] )
-            labels_test.append( labels[jj] )
-        
-        ### fit the classifier using training set, and test on test set
-        clf_best.fit(features_train, labels_train)
-        predictions = clf_best.predict(features_test)
-        for prediction, truth in zip(predictions, labels_test):
-            if prediction == 0 and truth == 0:
-                true_negatives += 1
-            elif prediction == 0 and truth == 1:
-                false_negatives += 1
-            elif prediction == 1 and truth == 0:
-                false_positives += 1
-            elif prediction == 1 and truth == 1:
-                true_positives += 1
-            
-    
-    total_predictions = true_negatives + false_negatives + false_positives + true_positives
-    accuracy = 1.0*(true_positives + true_negatives)/total_predictions
-    precision = 1.0*true_positives/(true_positives+false_positives)
-    recall = 1.0*true_positives/(true_positives+false_negatives)
-    f1 = 2.0 * true_positives/(2*true_positives + false_positives+false_negatives)
-
-    return [accuracy, precision, recall, f1]
+    # Features are scaled once, before the folds are drawn
+    records = evaluate_folds(clf_best,
+                             features,
+                             labels,
+                             prescale = True,
+                             n_jobs = n_jobs)
+
+    return pooled_scores(records)
@@ -0,0 +1,245 @@
+"""
+
+    The naive_bayes_cv Python module cross-validates a GaussianNB
+    (alone, or after a MinMaxScaler as in clf_builder.pipe_builder)
+    without fitting it on every fold.
+
+    A GaussianNB is determined by the count, the sum and the sum
+    of squares of every feature within every class. These are
+    computed once on the whole dataset; the statistics of a
+    training fold are the totals minus the contributions of its
+    test rows. Models and predictions of all the folds are then
+    computed at once with numpy:
+
+        predictions = predict_folds(clf, features, labels,
+                                    train, test)
+
+    where train and test are the index matrices of splits (see
+    cv_engine.batched_confusion_counts for their confusion counts).
+
+    Statistics are computed on features centred on the mean of
+    their class, which keeps sums of squares accurate, and the
+    variance of a feature that is constant within a class of a
+    fold is set to zero exactly. A MinMaxScaler is an affine map
+    of every feature, so its effect on the means, variances and
+    test rows of a fold is applied afterwards.
+
+"""
+
+import numpy as np
+from sklearn.naive_bayes import GaussianNB
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import MinMaxScaler
+
+###############################################################
+
+### SUPPORTED CLASSIFIERS ###
+
+def _steps(clf):
+
+    """
+
+        This function returns the MinMaxScaler (or None) and the
+        GaussianNB of a supported classifier, or None.
+
+    """
+
+    scaler = None
+
+    if isinstance(clf, Pipeline):
+
+        steps = [step for _, step in clf.steps]
+
+        if len(steps) == 2 and type(steps[0]) is MinMaxScaler:
+            scaler, clf = steps
+        elif len(steps) == 1:
+            clf = steps[0]
+        else:
+            return None
+
+    if type(clf) is not GaussianNB:
+        return None
+
+    return scaler, clf
+
+
+def supports(clf):
+
+    """
+
+        This function returns True if clf is a GaussianNB, or a
+        Pipeline of a MinMaxScaler and a GaussianNB.
+
+    """
+
+    return _steps(clf) is not None
+
+###############################################################
+
+### FOLD PREDICTIONS ###
+
+def _fold_extremes(features, selected):
+
+    """
+
+        This function returns the minimum and maximum of every
+        feature over the rows selected in every fold, without
+        gathering the rows of the folds: rows are sorted once per
+        feature, and the first and last selected rows of every
+        fold are found in that order.
+
+        Args:
+            - features: a numpy array
+            - selected: a boolean numpy array, one row per fold and
+                        one column per row of features (every fold
+                        selects at least one row)
+
+        Returns:
+            - low, high: numpy arrays, one row per fold
+
+    """
+
+    low = np.empty((len(selected), features.shape[1]))
+    high = np.empty((len(selected), features.shape[1]))
+
+    last = selected.shape[1] - 1
+
+    for j in range(features.shape[1]):
+
+        order = np.argsort(features[:, j], kind = 'mergesort')
+        in_order = selected[:, order]
+
+        first = np.argmax(in_order, axis = 1)
+        final = last - np.argmax(in_order[:, ::-1], axis = 1)
+
+        low[:, j] = features[order[first], j]
+        high[:, j] = features[order[final], j]
+
+    return low, high
+
+
+def predict_folds(clf, features, labels, train, test):
+
+    """
+
+        This function returns the predictions of a GaussianNB
+        (see supports) fitted on every training fold.
+
+        Args:
+            - clf: a supported classifier (it is not fitted)
+            - features, labels: array of features, labels extracted
+                                from the dataset
+            - train, test: integer numpy arrays, one row of indices
+                           per fold (see splits.load_splits). The
+                           training rows of a fold must be all the
+                           rows not in its test rows
+
+        Returns:
+            - predictions: a numpy array, one row per fold, aligned
+                           with test
+
+    """
+
+    scaler, nb = _steps(clf)
+
+    features = np.asarray(features, dtype = float)
+    labels = np.asarray(labels)
+    train = np.asarray(train)
+    test = np.asarray(test)
+
+    classes = np.unique(labels)
+    n_train = train.shape[1]
+
+    # Class indicator of every row
+    members = (labels[:, np.newaxis] == classes).astype(float)
+
+    # Totals of the whole dataset, on features centred on the
+    # mean of their class
+    count = members.sum(axis = 0)
+    shift = members.T.dot(features) / count[:, np.newaxis]
+    centred = features - members.dot(shift)
+
+    total = members.T.dot(centred)
+    squares = members.T.dot(centred ** 2)
+
+    # Minus the contributions of the test rows of every fold
+    test_members = members[test]
+    test_centred = centred[test]
+
+    fold_count = count - test_members.sum(axis = 1)
+    fold_total = total - np.einsum('fnc,fnd->fcd',
+                                   test_members, test_centred)
+    fold_squares = squares - np.einsum('fnc,fnd->fcd',
+                                       test_members, test_centred ** 2)
+
+    if (fold_count == 0).any():
+        raise ValueError('Every class must be in every training fold')
+
+    offset_mean = fold_total / fold_count[:, :, np.newaxis]
+    variance = np.maximum(fold_squares / fold_count[:, :, np.newaxis]
+                          - offset_mean ** 2, 0.)
+    theta = offset_mean + shift
+
+    # A feature constant within a class of a training fold (e.g.
+    # all zeros) has a null variance, which GaussianNB replaces
+    # with epsilon alone: it is set exactly, as rounding errors
+    # would not be small next to epsilon
+    in_train = np.zeros((len(train), len(labels)), dtype = bool)
+    in_train[np.arange(len(train))[:, np.newaxis], train] = True
+
+    for c in range(len(classes)):
+        low, high = _fold_extremes(features,
+                                   in_train & (members[:, c] == 1))
+        constant = low == high
+        variance[:, c][constant] = 0.
+        theta[:, c][constant] = low[constant]
+
+    # Variance of every feature over the whole training fold,
+    # within and between classes
+    weights = fold_count[:, :, np.newaxis] / n_train
+    overall_mean = np.sum(weights * theta, axis = 1)
+    between = (theta - overall_mean[:, np.newaxis, :]) ** 2
+    overall_variance = np.sum(weights * (variance + between), axis = 1)
+
+    test_features = features[test]
+
+    if scaler is not None:
+
+        # The MinMaxScaler fitted on every training fold
+        low, high = scaler.feature_range
+        data_min, data_max = _fold_extremes(features, in_train)
+        data_range = data_max - data_min
+        data_range[data_range == 0.] = 1.
+        scale = (high - low) / data_range
+        offset = low - data_min * scale
+
+        theta = theta * scale[:, np.newaxis, :] + offset[:, np.newaxis, :]
+        variance = variance * (scale ** 2)[:, np.newaxis, :]
+        overall_variance = overall_variance * scale ** 2
+        test_features = test_features * scale[:, np.newaxis, :] \
+                        + offset[:, np.newaxis, :]
+
+    # As GaussianNB: a small share of the largest variance is
+    # added to every variance (var_smoothing, from scikit-learn
+    # 0.20, 1e-9 before)
+    var_smoothing = getattr(nb, 'var_smoothing', 1e-9)
+    epsilon = var_smoothing * overall_variance.max(axis = 1)
+    sigma = variance + epsilon[:, np.newaxis, np.newaxis]
+
+    if nb.priors is not None:
+        prior = np.tile(np.asarray(nb.priors, dtype = float),
+                        (len(test), 1))
+    else:
+        prior = fold_count / fold_count.sum(axis = 1)[:, np.newaxis]
+
+    # Joint log likelihood of every test row and class, as
+    # GaussianNB._joint_log_likelihood
+    n_ij = - 0.5 * np.sum(np.log(2. * np.pi * sigma), axis = 2)
+    n_ij = n_ij[:, np.newaxis, :] \
+           - 0.5 * np.sum((test_features[:, :, np.newaxis, :]
+                           - theta[:, np.newaxis, :, :]) ** 2
+                          / sigma[:, np.newaxis, :, :], axis = 3)
+    joint_log_likelihood = np.log(prior)[:, np.newaxis, :] + n_ij
+
+    return classes[np.argmax(joint_log_likelihood, axis = 2)]
+
@@ -8,8 +8,10 @@
 """
 
 from sklearn.grid_search import GridSearchCV
-from sklearn.cross_validation import StratifiedShuffleSplit
+from sklearn.svm import SVC
 import clf_builder
+import kernel_svc
+import splits
 import sys
 
 
@@ -20,7 +22,8 @@ def optimise_clf(clf_dict,
 				 features,
 				 labels,
 				 scoring,
-         pca_bool = False):
+         pca_bool = False,
+         precomputed_kernel = False):
     
     """
         
@@ -34,6 +37,11 @@ def optimise_clf(clf_dict,
             - scoring: a string specifying the scoring algorithm
             - pca_bool: a boolean. If True, pca is applied as
                			part of a pipeline
+            - precomputed_kernel: a boolean. If True, an SVC
+            			without pca is optimised on kernel matrices
+            			computed once per fold, kernel and gamma
+            			rather than for every value of C (see
+            			kernel_svc)
                                
         Returns:
             - best_params: the parameters of the best estimators
@@ -42,7 +50,12 @@ def optimise_clf(clf_dict,
     
     # Define cv object
     # I am optimising over 10 splits
-    cv = StratifiedShuffleSplit(labels, n_iter=10, random_state=42)
+    cv = splits.load_folds(labels, n_folds=10, random_state=42)
+    
+    if precomputed_kernel and not pca_bool and \
+       type(clf_dict['classifier']) is SVC:
+        
+        return optimise_svc(clf_dict, features, labels, scoring, cv)
     
     if pca_bool:
         
@@ -79,6 +92,65 @@ def optimise_clf(clf_dict,
     return optimiser.best_estimator_, optimiser.best_params_
 
 
+def optimise_svc(clf_dict,
+                 features,
+                 labels,
+                 scoring,
+                 cv):
+    
+    """
+        
+        This function optimises an SVC using GridSearchCV on
+        precomputed kernel matrices (see kernel_svc). As in the
+        pipeline of optimise_clf, features are scaled on every
+        training fold, so the search scores the same models.
+        
+        Args:
+            - clf_dict: a dictionary with an SVC and its
+            		    parameters to be optimised
+            - features, labels: arrays to fit the optimiser on
+            - scoring: a string specifying the scoring algorithm
+            - cv: a list of (train_idx, test_idx) pairs
+                               
+        Returns:
+            - best_clf: the best estimator, as the scaler and SVC
+            			pipeline of clf_builder.pipe_builder fitted on
+            			features
+            - best_params: the parameters of the best estimator,
+            			   named as in the pipeline
+    
+    """
+    
+    key, rows = kernel_svc.prepare(features, prescale = False)
+    clf = kernel_svc.from_svc(clf_dict['classifier'], key,
+                              fold_scaling = True)
+
+    # The best classifier is fitted on features below instead
+    optimiser = GridSearchCV(clf,
+                             clf_dict['params'],
+                             scoring = scoring,
+                             cv = cv,
+                             refit = False)
+
+    # The n x n Gram matrices are only needed by the search
+    try:
+        optimiser.fit(rows, labels)
+    finally:
+        kernel_svc.release(key)
+
+    # The same classifier, taking features
+    best_clf = kernel_svc.to_pipeline(clf.set_params(
+        **optimiser.best_params_))
+    best_clf.fit(features, labels)
+    
+    step_name = best_clf.steps[-1][0]
+    best_params = dict((clf_builder.pipe_param_builder(step_name, param),
+                        value)
+                       for param, value in optimiser.best_params_.items())
+    
+    return best_clf, best_params
+
+
 #####################################
 ### LIST OPTIMISER ###
 
@@ -86,7 +158,8 @@ def optimise_list(clf_list,
                   features,
                   labels,
                   pca_bool = False,
-                  scoring = 'f1'):
+                  scoring = 'f1',
+                  precomputed_kernel = False):
     
     """
     
@@ -100,6 +173,8 @@ def optimise_list(clf_list,
             	   to a pipeline
             - scoring: string, the scoring algorithm for GridSearch.
                        Default is recall.
+            - precomputed_kernel: a boolean, used for SVCs (see
+            					  optimise_clf)
     
         Returns:
             - best_params: return a list with the best parameters
@@ -115,7 +190,9 @@ def optimise_list(clf_list,
                                              features = features,
                                              labels = labels,
                                              pca_bool = pca_bool,
-                                             scoring = scoring)
+                                             scoring = scoring,
+                                             precomputed_kernel =
+                                             precomputed_kernel)
         
         # Modify clf name is pca is applied
         if pca_bool:
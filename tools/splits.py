@@ -0,0 +1,172 @@
+"""
+
+    The splits Python module provides the StratifiedShuffleSplit
+    folds used by the evaluators and the optimiser.
+
+    All the folds are drawn at once and stored as two int32
+    matrices, one row per fold:
+
+        - train: the indices of the training observations;
+        - test: the indices of the test observations.
+
+    The matrices are saved as a .npz file, named after a hash of
+    the labels, the number of folds, the test size and the seed,
+    and kept in memory once loaded. Drawing the 1,000 folds of
+    tester.py is therefore a one-off cost per dataset.
+
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from sklearn.cross_validation import StratifiedShuffleSplit
+
+# Bump this when the way folds are drawn changes, so that old
+# split files are not reused
+SPLITS_VERSION = 1
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '..', 'data', 'cache')
+
+# Matrices already loaded, by key
+_SPLITS = {}
+
+###############################################################
+
+### SPLIT MATRICES ###
+
+def split_key(labels, n_folds, test_size, random_state):
+
+    """
+
+        This function returns the key identifying the folds of a
+        vector of labels.
+
+    """
+
+    labels = np.ascontiguousarray(labels, dtype = float)
+
+    parameters = json.dumps({'version': SPLITS_VERSION,
+                             'n_folds': n_folds,
+                             'test_size': test_size,
+                             'random_state': random_state},
+                            sort_keys = True)
+
+    sha = hashlib.sha1(labels.tostring())
+    sha.update(parameters.encode('utf-8'))
+
+    return sha.hexdigest()
+
+
+def draw_splits(labels, n_folds = 1000, test_size = 0.1, random_state = 42):
+
+    """
+
+        This function draws the folds of StratifiedShuffleSplit.
+
+        Args:
+            - labels: array of labels
+            - n_folds: an integer, i.e. the number of folds
+            - test_size: a float (share of the observations) or an
+                         integer (number of observations)
+            - random_state: an integer
+
+        Returns:
+            - train, test: int32 numpy arrays, one row per fold
+
+    """
+
+    cv = StratifiedShuffleSplit(labels,
+                                n_folds,
+                                test_size = test_size,
+                                random_state = random_state)
+
+    train = np.empty((n_folds, cv.n_train), dtype = np.int32)
+    test = np.empty((n_folds, cv.n_test), dtype = np.int32)
+
+    for i, (train_idx, test_idx) in enumerate(cv):
+        train[i] = train_idx
+        test[i] = test_idx
+
+    return train, test
+
+
+def load_splits(labels,
+                n_folds = 1000,
+                test_size = 0.1,
+                random_state = 42,
+                cache_dir = CACHE_DIR):
+
+    """
+
+        This function returns the folds of a vector of labels,
+        drawing and saving them only if they are not in the cache.
+
+        Args:
+            - labels: array of labels
+            - n_folds, test_size, random_state: as in draw_splits
+            - cache_dir: a string, i.e. the folder of the split
+                         files. If None, nothing is saved to disk
+
+        Returns:
+            - train, test: read-only int32 numpy arrays, one row per
+                           fold
+
+    """
+
+    key = split_key(labels, n_folds, test_size, random_state)
+
+    if key in _SPLITS:
+        return _SPLITS[key]
+
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, 'splits_' + key + '.npz')
+
+    if path is not None and os.path.exists(path):
+
+        with np.load(path) as split_file:
+            train, test = split_file['train'], split_file['test']
+
+    else:
+
+        train, test = draw_splits(labels, n_folds, test_size, random_state)
+
+        if path is not None:
+
+            if not os.path.isdir(cache_dir):
+                try:
+                    os.makedirs(cache_dir)
+                except OSError:
+                    # Another worker created it in the meantime
+                    pass
+
+            # Write to a temporary file first, so that a parallel
+            # worker never opens a half-written file
+            tmp_path = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp_path, 'wb') as tmp_file:
+                np.savez(tmp_file, train = train, test = test)
+            os.rename(tmp_path, path)
+
+    train.flags.writeable = False
+    test.flags.writeable = False
+
+    _SPLITS[key] = train, test
+
+    return train, test
+
+
+def load_folds(labels, n_folds = 1000, **kwargs):
+
+    """
+
+        This function returns the folds of load_splits as a list of
+        (train_idx, test_idx) pairs, i.e. as a cv argument of
+        GridSearchCV or a folds argument of cv_engine.
+
+    """
+
+    train, test = load_splits(labels, n_folds, **kwargs)
+
+    return list(zip(train, test))
@@ -0,0 +1,220 @@
+"""
+
+    The stream_parser Python module parses datasets that do not
+    fit in memory, one bounded chunk of records at a time.
+
+    Records are read lazily from:
+
+        - a JSONL file, i.e. one JSON object per line, with a
+          'name' field and the features of that person;
+        - a CSV file with a 'name' column (as the one created by
+          eda/csv_creator.py);
+        - a sequence of pickle shards, each one a data dictionary
+          formatted as the Enron one.
+
+    Every chunk goes through the same steps as dict_parser.parse
+    (outlier removal and variable_adder transformations, which are
+    all row-local) and is appended to an on-disk columnar store
+    (see dataset_store). Peak memory is therefore bounded by the
+    chunk size, not by the size of the dataset.
+
+"""
+
+import json
+import pickle
+
+import pandas as pd
+
+import dict_parser
+import variable_adder
+import dataset_store
+
+###############################################################
+
+### READERS ###
+
+# Every reader yields chunks of at most chunk_size records,
+# either as data dictionaries or as pandas dataframes with
+# names in the first column.
+
+def read_jsonl(path, chunk_size = 10000):
+
+    """
+
+        This function reads a JSONL file in chunks.
+
+        Args:
+            - path: a string, i.e. the path of the file
+            - chunk_size: an integer, i.e. the number of records
+                          per chunk
+
+        Returns:
+            - a generator of data dictionaries
+
+    """
+
+    chunk = {}
+
+    with open(path) as jsonl_file:
+
+        for line in jsonl_file:
+
+            line = line.strip()
+            if not line:
+                continue
+
+            record = json.loads(line)
+            chunk[record.pop('name')] = record
+
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = {}
+
+    if chunk:
+        yield chunk
+
+
+def read_csv(path, chunk_size = 10000):
+
+    """
+
+        This function reads a CSV file in chunks.
+
+        Args:
+            - path: a string, i.e. the path of the file
+            - chunk_size: an integer, i.e. the number of records
+                          per chunk
+
+        Returns:
+            - a generator of pandas dataframes
+
+    """
+
+    for chunk in pd.read_csv(path, chunksize = chunk_size):
+
+        # Drop the index column written by DataFrame.to_csv
+        chunk = chunk[[column for column in chunk.columns
+                       if not column.startswith('Unnamed:')]]
+
+        # Names first, as in dict_parser.convert_into_df
+        variables = [column for column in chunk.columns
+                     if column != 'name']
+        chunk = chunk[['name'] + variables].copy()
+
+        for variable in variables:
+            if variable != 'email_address':
+                chunk[variable] = chunk[variable].astype(float)
+            else:
+                # Kept as the 'NaN' string, as dict_parser does
+                chunk[variable] = chunk[variable].astype(object) \
+                                                 .fillna('NaN')
+
+        yield chunk.reset_index(drop = True)
+
+
+def read_pickle_shards(paths, chunk_size = 10000):
+
+    """
+
+        This function reads a sequence of pickled data dictionaries
+        (one shard in memory at a time) in chunks.
+
+        Args:
+            - paths: a list of strings, i.e. the paths of the shards
+            - chunk_size: an integer, i.e. the number of records
+                          per chunk
+
+        Returns:
+            - a generator of data dictionaries
+
+    """
+
+    for path in paths:
+
+        with open(path, 'rb') as shard_file:
+            shard = pickle.load(shard_file)
+
+        names = list(shard.keys())
+
+        for start in range(0, len(names), chunk_size):
+            yield dict((name, shard.pop(name))
+                       for name in names[start:start + chunk_size])
+
+###############################################################
+
+### STREAM PARSE ###
+
+def stream_parse(chunks,
+                 store_dir,
+                 outliers,
+                 adder_dictionary,
+                 log_sqrt = None,
+                 append = False):
+
+    """
+
+        This function parses chunks of records and appends them to
+        an on-disk columnar store.
+
+        Args:
+            - chunks: an iterable of data dictionaries or pandas
+                      dataframes, e.g. one of the readers above
+            - store_dir: a string, i.e. the folder of the store
+            - outliers: a Python list
+            - adder_dictionary: a Python dictionary
+            - log_sqrt: a Python list. By default it is set to None
+            - append: a boolean. By default the parts of an earlier
+                      run are removed first (see
+                      dataset_store.clear_store); if True, the
+                      chunks are appended to them
+
+        Returns:
+            - n_records: an integer, i.e. the number of records
+                         written to the store
+
+        The store can be read back with dataset_store.iter_store
+        (one memory-mapped chunk at a time) or
+        dataset_store.load_store.
+
+    """
+
+    fields = None
+    n_records = 0
+
+    # Compile the variables to add once for all the chunks
+    plan = variable_adder.compile_plan(adder_dictionary, log_sqrt)
+
+    if not variable_adder.is_row_local(plan):
+        raise ValueError('Transforms that are not row-local (e.g. '
+                         'rank) cannot be computed chunk by chunk')
+
+    if not append:
+        dataset_store.clear_store(store_dir)
+
+    for chunk in chunks:
+
+        # Convert into a dataframe, with the same columns for
+        # every chunk
+        if isinstance(chunk, pd.DataFrame):
+            dataframe = chunk
+        else:
+            if fields is None:
+                fields = dict_parser.extract_fields_from_dict(chunk)
+            dataframe = dict_parser.convert_into_df(chunk, fields)
+
+        # Remove outliers
+        dataframe = dict_parser.remove_outliers(dataframe, outliers)
+
+        if not len(dataframe):
+            continue
+
+        # Add variables
+        dataframe = variable_adder.execute_plan(dataframe, plan)
+
+        dataset_store.append_to_store(
+            store_dir,
+            dict_parser.write_dictionary(dataframe, as_columnar = True))
+
+        n_records += len(dataframe)
+
+    return n_records
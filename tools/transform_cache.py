@@ -0,0 +1,162 @@
+"""
+
+    The transform_cache Python module shares the preprocessing of
+    a fold between pipelines.
+
+    The pipelines of clf_builder.pipe_builder all start with a
+    MinMaxScaler (and, with pca_bool, a PCA). Evaluated on the same
+    folds, they fit the same transformers on the same training
+    observations. A TransformCache fits every distinct chain of
+    transformers once per fold and keeps the transformed train
+    and test blocks, keyed by:
+
+        (fold id, ((transformer class, parameters), ...))
+
+    The least recently used blocks are dropped once the cache
+    holds max_entries of them.
+
+"""
+
+from collections import OrderedDict
+
+from sklearn.base import clone
+from sklearn.pipeline import Pipeline
+
+###############################################################
+
+### PIPELINE STEPS ###
+
+def split_pipeline(clf):
+
+    """
+
+        This function returns the transformers and the final
+        estimator of a classifier (a classifier that is not a
+        Pipeline has no transformers).
+
+    """
+
+    if isinstance(clf, Pipeline):
+        return [step for _, step in clf.steps[:-1]], clf.steps[-1][1]
+
+    return [], clf
+
+
+def step_key(step):
+
+    """
+
+        This function returns the part of a cache key identifying
+        a transformer, i.e. its class and parameters.
+
+    """
+
+    params = sorted(step.get_params(deep = False).items())
+
+    return type(step).__name__, repr(params)
+
+###############################################################
+
+### TRANSFORM CACHE ###
+
+class TransformCache(object):
+
+    """
+
+        A least recently used cache of transformed fold blocks.
+
+        A chain of transformers is registered once with chain,
+        which returns its key (the transformers are cloned then,
+        and fitted again on every fold):
+
+            cache = TransformCache()
+            key = cache.chain(split_pipeline(pipe)[0])
+            train, test = cache.transform(fold_id, key, ...)
+
+        Args:
+            - max_entries: an integer, i.e. the number of
+                           (train, test) blocks kept
+
+    """
+
+    def __init__(self, max_entries = 64):
+
+        self.max_entries = max_entries
+        self.blocks = OrderedDict()
+        self.transformers = {}
+        self.hits = 0
+        self.misses = 0
+
+    def chain(self, transformers):
+
+        """
+
+            This function registers a chain of transformers and
+            returns its key, i.e. a tuple with the step_key of
+            every transformer.
+
+        """
+
+        key = tuple(step_key(step) for step in transformers)
+
+        # One transformer for every distinct prefix of the chain
+        for i, step in enumerate(transformers):
+            if key[:i + 1] not in self.transformers:
+                self.transformers[key[:i + 1]] = clone(step)
+
+        return key
+
+    def transform(self,
+                  fold_id,
+                  chain,
+                  features_train,
+                  labels_train,
+                  features_test):
+
+        """
+
+            This function returns the train and test features of a
+            fold after a chain of transformers, as a Pipeline would
+            compute them (fit_transform on train, transform on test).
+
+            Args:
+                - fold_id: a hashable, identifying the fold
+                - chain: a tuple, as returned by chain
+                - features_train, labels_train, features_test: the
+                  arrays of the fold
+
+            Returns:
+                - train, test: numpy arrays
+
+        """
+
+        if not chain:
+            return features_train, features_test
+
+        key = (fold_id, chain)
+
+        if key in self.blocks:
+            self.hits += 1
+            # Most recently used last
+            blocks = self.blocks.pop(key)
+            self.blocks[key] = blocks
+            return blocks
+
+        self.misses += 1
+
+        # The chain without its last step is often shared too
+        train, test = self.transform(fold_id,
+                                     chain[:-1],
+                                     features_train,
+                                     labels_train,
+                                     features_test)
+
+        step = self.transformers[chain]
+        train = step.fit_transform(train, labels_train)
+        test = step.transform(test)
+
+        self.blocks[key] = train, test
+        while len(self.blocks) > self.max_entries:
+            self.blocks.popitem(last = False)
+
+        return train, test
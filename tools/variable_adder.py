@@ -29,6 +29,17 @@
     The wealth variable will be the sum of salary, bonus and
     total_stock_value.
 
+    Any transform in the TRANSFORMS registry can be used as a key
+    of the adder dictionary, e.g.
+
+        adder_dictionary = {'difference' :
+                {'cash_minus_stock': ['salary', 'total_stock_value']},
+                'quantile' : {'bonus_quantile' : ['bonus']}}
+
+    The registry holds ratio, additive, difference, product,
+    clipped_ratio, log, sqrt, rank and quantile; new transforms
+    are added with register_transform.
+
 """
 
 import pandas as pd
@@ -136,9 +147,377 @@ def log_sqrt_adder(dataframe, variable):
 
 
 
+##################################
+# ~~~~~~~~~~~~~~ TRANSFORMS ~~~~~~
+
+class Transform(object):
+
+    """
+
+        A named, vectorized column transform.
+
+        Args:
+            - function: a function taking a list of input columns
+                        (float numpy arrays) and an output column,
+                        which it fills in place
+            - row_local: a boolean. False if a value depends on
+                         other rows (e.g. a rank), in which case the
+                         transform cannot be run chunk by chunk
+            - initial: a float or None. If given, the output column
+                       is filled with it before the inputs are
+                       read, and the new variable reads as that
+                       value if it is one of its own inputs (as in
+                       add_additive)
+
+    """
+
+    def __init__(self, function, row_local = True, initial = None):
+
+        self.function = function
+        self.row_local = row_local
+        self.initial = initial
+
+
+TRANSFORMS = {}
+
+
+def register_transform(name, row_local = True, initial = None):
+
+    """
+
+        This function returns a decorator adding a function to
+        the TRANSFORMS registry under a given name, so that the
+        name can be used as a key of an adder dictionary.
+
+        Args:
+            - name: a string
+            - row_local, initial: see Transform
+
+    """
+
+    def decorator(function):
+        TRANSFORMS[name] = Transform(function, row_local, initial)
+        return function
+
+    return decorator
+
+
+# Every transform writes one output column with one ufunc call
+# per input (NaN values propagate, as with pandas arithmetic),
+# except rank and quantile, which need a sort.
+
+@register_transform('ratio')
+def ratio_transform(inputs, out):
+    np.divide(inputs[0], inputs[1], out=out)
+
+
+@register_transform('additive', initial = 0.)
+def additive_transform(inputs, out):
+    # NaN terms are counted as zero, i.e. skipped in place
+    for values in inputs:
+        np.add(out, values, out=out, where=~np.isnan(values))
+
+
+@register_transform('difference')
+def difference_transform(inputs, out):
+    np.subtract(inputs[0], inputs[1], out=out)
+
+
+@register_transform('product')
+def product_transform(inputs, out):
+    np.multiply(inputs[0], inputs[1], out=out)
+    for values in inputs[2:]:
+        np.multiply(out, values, out=out)
+
+
+@register_transform('clipped_ratio')
+def clipped_ratio_transform(inputs, out):
+    # A ratio clipped to [0, 1], e.g. a share of messages
+    np.divide(inputs[0], inputs[1], out=out)
+    np.clip(out, 0., 1., out=out)
+
+
+@register_transform('log')
+def log_transform(inputs, out):
+    np.log10(inputs[0], out=out)
+
+
+@register_transform('sqrt')
+def sqrt_transform(inputs, out):
+    np.sqrt(inputs[0], out=out)
+
+
+def average_ranks(values):
+
+    """
+
+        This function ranks the values of every row of a 2-D array
+        (from 1), ties taking their average rank, as
+        scipy.stats.rankdata does on a single row.
+
+    """
+
+    n_rows, n_columns = values.shape
+
+    order = np.argsort(values, axis = 1, kind = 'mergesort')
+    rows = np.arange(n_rows)[:, np.newaxis]
+    ordered = values[rows, order]
+
+    # Runs of equal values, within a row
+    starts = np.ones(ordered.shape, dtype = bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    starts = starts.ravel()
+
+    run = np.cumsum(starts) - 1
+    first = np.flatnonzero(starts)
+    length = np.diff(np.r_[first, starts.size])
+
+    # Average of the ranks first + 1 ... first + length of a run
+    position = first % n_columns
+    average = position + (length + 1) / 2.
+
+    ranks = np.empty(values.shape)
+    ranks[rows, order] = average[run].reshape(values.shape)
+
+    return ranks
+
+
+def _rank_known(values, out):
+
+    """
+
+        Fill out with the ranks of the non-NaN values (NaN
+        elsewhere), as pandas.Series.rank, and return their number.
+
+    """
+
+    known = ~np.isnan(values)
+
+    out[:] = np.nan
+    out[known] = average_ranks(values[known][np.newaxis, :])[0]
+
+    return int(known.sum())
+
+
+@register_transform('rank', row_local = False)
+def rank_transform(inputs, out):
+    _rank_known(inputs[0], out)
+
+
+@register_transform('quantile', row_local = False)
+def quantile_transform(inputs, out):
+    # As pandas.Series.rank(pct=True)
+    n = _rank_known(inputs[0], out)
+    if n:
+        np.divide(out, n, out=out)
+
+
+def is_row_local(plan):
+
+    """
+
+        This function returns True if every step of a plan only
+        reads values of its own row, i.e. if the plan gives the
+        same result on a whole dataset and on chunks of it.
+
+    """
+
+    return all(TRANSFORMS[kind].row_local for kind, _, _ in plan)
+
+
+##################################
+# ~~~~~~~~~~~~~~ COMPILE PLAN ~~~~
+def compile_plan(adder_dictionary, log_sqrt, features_list = None):
+
+    """
+
+        This function compiles an adder dictionary and a log_sqrt
+        list into an execution plan, i.e. the list of variables to
+        add in the order in which add_all adds them.
+
+        Args:
+            - adder_dictionary: a Python dictionary
+            - log_sqrt: a Python list (or None)
+            - features_list: a Python list (or None). If given, the
+                             plan only keeps the variables needed
+                             to compute it (see prune_plan)
+
+        Returns:
+            - plan: a Python list of (kind, new_var, variables)
+                    tuples, where kind is a key of TRANSFORMS. Keys
+                    of adder_dictionary that are not in TRANSFORMS
+                    are ignored
+
+    """
+
+    plan = []
+
+    for adder, instruction in adder_dictionary.items():
+
+        # As add_all always did, keys that are not transforms
+        # are ignored
+        if adder not in TRANSFORMS:
+            continue
+
+        for key, variables in instruction.items():
+            plan.append((adder, key, list(variables)))
+
+    for variable in log_sqrt or []:
+        plan.append(('log', 'log_' + variable, [variable]))
+        plan.append(('sqrt', 'sqrt_' + variable, [variable]))
+
+    if features_list is not None:
+        plan = prune_plan(plan, features_list)
+
+    return plan
+
+
+def prune_plan(plan, features_list):
+
+    """
+
+        This function keeps only the steps of a plan that are
+        needed to compute the variables in features_list, e.g.
+        sqrt_wealth needs the sqrt step of wealth, which needs the
+        additive step of wealth (but not log_wealth).
+
+        Args:
+            - plan: a Python list, as returned by compile_plan
+            - features_list: a Python list of variable names
+
+        Returns:
+            - plan: a Python list, i.e. the needed steps in their
+                    original order
+
+    """
+
+    needed = set(features_list)
+    kept = []
+
+    # Walk the plan backwards, so that a step is kept if its
+    # variable is needed by features_list or by a later kept step
+    for kind, new_var, variables in reversed(plan):
+
+        if new_var not in needed:
+            continue
+
+        kept.append((kind, new_var, variables))
+        needed.discard(new_var)
+
+        # An additive variable is reset to zero before its terms
+        # are read, so it never needs its own previous value
+        resets = TRANSFORMS[kind].initial is not None
+        needed.update(variable for variable in variables
+                      if not (resets and variable == new_var))
+
+    return kept[::-1]
+
+
+def plan_variables(plan):
+
+    """
+
+        This function returns the names of the variables added by
+        a plan, in the order in which they are added (a variable
+        added twice keeps its first position).
+
+    """
+
+    unique = []
+    for _, new_var, _ in plan:
+        if new_var not in unique:
+            unique.append(new_var)
+
+    return unique
+
+
+##################################
+# ~~~~~~~~~~~~~~ EXECUTE PLAN ~~~~
+def execute_plan(dataframe, plan, dtype = float):
+
+    """
+
+        This function returns a pandas dataframe after having
+        added the variables of a compiled plan.
+
+        All the new variables are computed with NumPy into one
+        preallocated block, every transform writing its column in
+        place (see TRANSFORMS), which is then joined to the
+        dataframe at once. Values are the same as with add_ratio,
+        add_additive and log_sqrt_adder; -inf values are replaced
+        with zero in the new variables only.
+
+        Args:
+            - dataframe: a pandas dataframe
+            - plan: a Python list, as returned by compile_plan
+            - dtype: the numpy type of the new variables, e.g.
+                     np.float32 to halve their memory. By default
+                     it is float (i.e. float64)
+
+        Returns:
+            - dataframe: a pandas dataframe with the added variables
+
+    """
+
+    # Position of every new variable in the block (a variable
+    # computed twice keeps its first position, as in add_all)
+    names = plan_variables(plan)
+    positions = dict((name, j) for j, name in enumerate(names))
+
+    block = np.empty((len(dataframe), len(names)), dtype=dtype)
+    computed = set()
+
+    def column(variable):
+        # Later steps can use variables computed by earlier ones
+        if variable in computed:
+            return block[:, positions[variable]]
+        return np.asarray(dataframe[variable].values, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        for kind, new_var, variables in plan:
+
+            transform = TRANSFORMS[kind]
+            out = block[:, positions[new_var]]
+
+            if transform.initial is not None:
+                # As in add_additive, the new variable is set before
+                # its inputs are read
+                out[:] = transform.initial
+                computed.add(new_var)
+
+            transform.function([column(variable)
+                                for variable in variables], out)
+
+            computed.add(new_var)
+
+    # Replace -inf values with zero
+    block[block == -np.inf] = 0
+
+    # Overwrite existing variables, join the new ones in one go
+    new = [name for name in names if name not in dataframe.columns]
+    existing = [name for name in names if name in dataframe.columns]
+
+    dataframe = pd.concat([dataframe,
+                           pd.DataFrame(block[:, [positions[name]
+                                                  for name in new]],
+                                        index = dataframe.index,
+                                        columns = new)],
+                          axis = 1)
+
+    for name in existing:
+        dataframe[name] = block[:, positions[name]]
+
+    return dataframe
+
+
 ##################################
 # ~~~~~~~~~~~~~~ ADD ALL ~~~~~~~~~
-def add_all(dataframe, adder_dictionary, log_sqrt):
+def add_all(dataframe,
+            adder_dictionary,
+            log_sqrt,
+            features_list = None,
+            dtype = float):
     
     """
         This function returns a pandas dataframe after having
@@ -151,40 +530,22 @@ def add_all(dataframe, adder_dictionary, log_sqrt):
             - log_sqrt: a Python of variables for which log10 and
                         sqrt transformations are added to the
                         dataframe
+            - features_list: a Python list (or None). If given, only
+                             the variables needed to compute it are
+                             added
+            - dtype: the numpy type of the added variables (see
+                     execute_plan)
 
         Returns:
             - dataframe: a pandas dataframe with the added variables
+
+        The adder dictionary is compiled into a plan (see
+        compile_plan) which is evaluated by execute_plan.
     
     """
-    
-    for adder, instruction in adder_dictionary.items():
-        
-        if adder == 'ratio':
-            
-            for key, variables in instruction.items():
-                
-                dataframe = add_ratio(dataframe,
-                                      key,
-                                      variables[0],
-                                      variables[1])
-                
-        if adder == 'additive':
-            
-            for key, variables in instruction.items():
-                
-                dataframe = add_additive(dataframe,
-                                         key,
-                                         variables)
-                
-                    
-    if log_sqrt:
 
-        for variable in log_sqrt:
-
-            dataframe = log_sqrt_adder(dataframe,
-                                       variable)
-
-    # Replace -inf values with zero
-    dataframe = dataframe.replace(-np.inf, 0)
-
-    return dataframe
+    return execute_plan(dataframe,
+                        compile_plan(adder_dictionary,
+                                     log_sqrt,
+                                     features_list),
+                        dtype)